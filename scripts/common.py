@@ -6,10 +6,15 @@
 
 from __future__ import annotations
 
+import atexit
+import functools
 import logging
+import logging.handlers
+import os
+import queue
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Iterable, Dict
+from typing import Any, Iterable, Dict, Optional
 
 import polars as pl
 from filelock import FileLock
@@ -26,6 +31,9 @@ INVENTORY_PATH = DATA_DIR / "inventario_videos.parquet"
 LOCK_PATH = DATA_DIR / "inventario.lock"
 LOG_FILE = LOGS_DIR / "pipeline.log"
 
+# Rows per Parquet row-group when rewriting the inventory
+INVENTORY_ROW_GROUP_SIZE = 4096
+
 
 # --- Inventory schema ---------------------------------------------------
 INVENTORY_COLUMNS = [
@@ -56,13 +64,31 @@ def _setup_logger() -> logging.Logger:
     # Console
     ch = logging.StreamHandler()
     ch.setFormatter(fmt)
-    logger.addHandler(ch)
 
     # File (ensure logs dir exists)
     LOGS_DIR.mkdir(parents=True, exist_ok=True)
     fh = logging.FileHandler(LOG_FILE, encoding="utf-8")
     fh.setFormatter(fmt)
-    logger.addHandler(fh)
+
+    # Console/file writes happen on a background thread; logging calls on the
+    # hot paths only enqueue the record.
+    log_queue: queue.Queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(
+        log_queue, ch, fh, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    # Forked children (e.g. editor pool workers) don't inherit the listener
+    # thread, so they write through the handlers directly.
+    def _use_direct_handlers() -> None:
+        logger.handlers.clear()
+        logger.addHandler(ch)
+        logger.addHandler(fh)
+
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=_use_direct_handlers)
 
     return logger
 
@@ -71,31 +97,37 @@ logger = _setup_logger()
 
 
 # --- Helpers ------------------------------------------------------------
+# Folders already created by this process and whether the inventory has been
+# verified; lets hot paths skip repeated mkdir calls and lock acquisitions.
+_created_dirs: set[Path] = set()
+_inventory_checked = False
+
+
 def ensure_dirs() -> None:
     """Create the basic folders if they don't exist."""
     for p in (DATA_DIR, RAW_DIR, PROCESSED_DIR, LOGS_DIR):
+        if p in _created_dirs:
+            continue
         p.mkdir(parents=True, exist_ok=True)
+        _created_dirs.add(p)
 
 
 def ensure_inventory() -> None:
     """Create an empty inventory file with the expected schema if missing."""
+    global _inventory_checked
+    if _inventory_checked and INVENTORY_PATH.exists():
+        return
+
     ensure_dirs()
     lock = FileLock(str(LOCK_PATH))
     try:
         with lock:
             if INVENTORY_PATH.exists():
+                _inventory_checked = True
                 return
 
-            cols = {
-                name: pl.Series(name, [], dtype=dtype)
-                for name, dtype in INVENTORY_COLUMNS
-            }
-            df = pl.DataFrame(cols)
-            df = df.with_columns(
-                df["created_at"].dt.convert_time_zone("UTC"),
-                df["updated_at"].dt.convert_time_zone("UTC"),
-            )
-            df.write_parquet(INVENTORY_PATH)
+            _sink_inventory(pl.LazyFrame(schema=dict(INVENTORY_COLUMNS)))
+            _inventory_checked = True
             logger.info("Created new inventory at %s", INVENTORY_PATH)
     except Exception:
         logger.exception("Failed to create inventory at %s", INVENTORY_PATH)
@@ -108,95 +140,204 @@ def _read_inventory_lazy() -> pl.LazyFrame:
     return pl.scan_parquet(str(INVENTORY_PATH))
 
 
+# --- Inventory id cache -------------------------------------------------
+def _inventory_signature() -> Optional[tuple]:
+    try:
+        st = os.stat(INVENTORY_PATH)
+    except FileNotFoundError:
+        return None
+    return (str(INVENTORY_PATH), st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _invalidate_inventory_cache() -> None:
+    _load_existing_ids.cache_clear()
+
+
+@functools.lru_cache(maxsize=2)
+def _load_existing_ids(signature: Optional[tuple]) -> frozenset[str]:
+    """Return every inventory `video_id`, loaded with one projected scan.
+
+    Keyed by `_inventory_signature()` so a file swapped in by another process
+    is picked up too; writes from this process also clear it explicitly.
+    """
+    if signature is None:
+        return frozenset()
+    ids = pl.scan_parquet(str(INVENTORY_PATH)).select("video_id").collect()
+    return frozenset(ids["video_id"].to_list())
+
+
 def read_inventory() -> pl.DataFrame:
     """Read the inventory file and return it as a Polars DataFrame."""
-    ensure_dirs()
-    if not INVENTORY_PATH.exists():
-        cols = {
-            name: pl.Series(name, [], dtype=dtype) for name, dtype in INVENTORY_COLUMNS
-        }
-        df = pl.DataFrame(cols)
-        df.write_parquet(INVENTORY_PATH)
-        return df
-
-    df = pl.read_parquet(INVENTORY_PATH)
-    return df.with_columns(
-        df["created_at"].dt.convert_time_zone("UTC"),
-        df["updated_at"].dt.convert_time_zone("UTC"),
+    ensure_inventory()
+    # Timestamps are stored as Datetime("us", "UTC"), so no conversion needed
+    return pl.read_parquet(INVENTORY_PATH)
+
+
+def _sink_inventory(lf: pl.LazyFrame) -> None:
+    """Stream `lf` into a sibling temp file and atomically swap it in.
+
+    Rows are clustered by `status_fb` (oldest first within each status) and
+    written in small row-groups with statistics, so status filters can skip
+    whole row-groups from the footer min/max alone. This is the only way the
+    inventory is written: the rename is atomic, so lock-free readers always
+    see either the old or the new complete file. Callers must hold the
+    inventory `FileLock` to serialize writers.
+    """
+    tmp_path = INVENTORY_PATH.with_name(INVENTORY_PATH.name + ".tmp")
+    lf.sort(["status_fb", "created_at"], maintain_order=True).sink_parquet(
+        str(tmp_path),
+        compression="zstd",
+        statistics=True,
+        row_group_size=INVENTORY_ROW_GROUP_SIZE,
     )
+    tmp_path.replace(INVENTORY_PATH)
+    _invalidate_inventory_cache()
 
 
 def _append_to_inventory(rows: Iterable[Dict]) -> None:
     """Append new rows to inventory while attempting to avoid duplicates.
 
-    Uses a simple in-memory append: load existing DF, concat, dedupe on `video_id`.
-    This is fine for small-to-medium inventories. For very large inventories consider
-    partitioned parquet or a proper DB.
+    New rows are anti-joined against the existing `video_id`s and appended
+    through a lazy scan + streaming sink, so neither the full existing
+    inventory nor a full-table dedupe has to be held in memory. Missing
+    `created_at` / `updated_at` values are filled with the append time.
     """
     ensure_inventory()
-    new_df = pl.DataFrame(rows)
+    # Build with the inventory schema so Polars skips inference and
+    # timestamps land as UTC directly; `strict=False` coerces loose values
+    # (e.g. a float duration) instead of re-casting afterwards.
+    new_df = pl.DataFrame(rows, schema=dict(INVENTORY_COLUMNS), strict=False)
     if new_df.is_empty():
         return
 
-    new_df = new_df.with_columns(
-        new_df["created_at"].dt.convert_time_zone("UTC"),
-        new_df["updated_at"].dt.convert_time_zone("UTC"),
+    # Rows may leave the timestamps out: the whole batch is stamped with one
+    # clock read here instead of building a datetime per row in Python.
+    ts = pl.lit(_now(), dtype=pl.Datetime("us", "UTC"))
+    new_lf = (
+        new_df.lazy()
+        .unique(subset=["video_id"], keep="first", maintain_order=True)
+        .with_columns(
+            pl.col("created_at").fill_null(ts),
+            pl.col("updated_at").fill_null(ts),
+        )
     )
     lock = FileLock(str(LOCK_PATH))
     try:
         with lock:
-            existing = pl.read_parquet(INVENTORY_PATH)
-            combined = pl.concat([existing, new_df], how="vertical")
-            combined = combined.unique(subset=["video_id"], keep="first")
-            combined.write_parquet(INVENTORY_PATH)
+            existing_lf = pl.scan_parquet(str(INVENTORY_PATH))
+            fresh_lf = new_lf.join(
+                existing_lf.select("video_id"), on="video_id", how="anti"
+            )
+            _sink_inventory(pl.concat([existing_lf, fresh_lf], how="vertical"))
             logger.info("Appended %d rows to inventory", len(new_df))
     except Exception:
         logger.exception("Failed appending to inventory at %s", INVENTORY_PATH)
         raise
 
 
-def update_inventory_by_video_id(video_id: str, updates: Dict) -> bool:
-    """Update a row identified by `video_id`.
+class BatchInventoryWriter:
+    """Buffer inventory rows and append them in one write on exit.
 
-    Returns True if a row was updated. The function applies `updates` to any
-    matching row and automatically sets `updated_at` to the current UTC time.
+    Use as a context manager around a loop that produces many rows, so the
+    inventory is rewritten once for the whole batch instead of once per row::
+
+        with BatchInventoryWriter() as writer:
+            for row in rows:
+                writer.add(row)
+
+    Nothing is written if the block raises.
     """
+
+    def __init__(self) -> None:
+        self.rows: list[Dict] = []
+
+    def add(self, row: Dict) -> None:
+        self.rows.append(row)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def flush(self) -> None:
+        """Append the buffered rows under the inventory lock and clear them."""
+        if self.rows:
+            _append_to_inventory(self.rows)
+            self.rows = []
+
+    def __enter__(self) -> "BatchInventoryWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+def update_inventory_batch(updates: Dict[str, Dict]) -> int:
+    """Apply `{video_id: {column: value}}` updates in a single rewrite.
+
+    Returns the number of rows updated. Each matching row also gets
+    `updated_at` set to the current UTC time. Unknown ids are ignored and the
+    file is left untouched when none of the ids exist.
+    """
+    if not updates:
+        return 0
+
+    ids = list(updates)
+    ts = _now()
     lock = FileLock(str(LOCK_PATH))
     try:
         with lock:
-            df = pl.read_parquet(INVENTORY_PATH)
-            mask = df["video_id"] == video_id
-            if mask.any() is False:
-                return False
+            lf = pl.scan_parquet(str(INVENTORY_PATH))
+            matches = (
+                lf.filter(pl.col("video_id").is_in(ids))
+                .select(pl.len())
+                .collect()
+                .item()
+            )
+            if matches == 0:
+                return 0
+
+            # Group ids by the value they assign so each column gets one
+            # when/then chain, however many videos are in the batch.
+            columns = lf.collect_schema().names()
+            by_column: Dict[str, Dict[Any, list]] = {}
+            for video_id, row_updates in updates.items():
+                for k, v in row_updates.items():
+                    if k in columns:
+                        by_column.setdefault(k, {}).setdefault(v, []).append(video_id)
 
-            # Build expressions to update columns in a single pass
             exprs = []
-            for k, v in updates.items():
-                if k in df.columns:
-                    exprs.append(
-                        pl.when(pl.col("video_id") == video_id)
-                        .then(pl.lit(v))
-                        .otherwise(pl.col(k))
-                        .alias(k)
-                    )
-
-            # Update `updated_at` timestamp for that row
+            for k, groups in by_column.items():
+                expr: Any = pl
+                for v, video_ids in groups.items():
+                    expr = expr.when(pl.col("video_id").is_in(video_ids)).then(pl.lit(v))
+                exprs.append(expr.otherwise(pl.col(k)).alias(k))
+
+            # Update `updated_at` timestamp for every matched row
             exprs.append(
-                pl.when(pl.col("video_id") == video_id)
-                .then(pl.lit(datetime.now(timezone.utc)))
+                pl.when(pl.col("video_id").is_in(ids))
+                .then(pl.lit(ts))
                 .otherwise(pl.col("updated_at"))
                 .alias("updated_at")
             )
 
-            df = df.with_columns(exprs)
-            df.write_parquet(INVENTORY_PATH)
-            logger.info("Updated inventory for %s: %s", video_id, updates)
-            return True
+            _sink_inventory(lf.with_columns(exprs))
+            logger.info("Updated inventory for %d rows: %s", matches, updates)
+            return matches
     except Exception:
-        logger.exception("Failed updating inventory for %s", video_id)
+        logger.exception("Failed updating inventory for %s", ids)
         raise
 
 
+def update_inventory_by_video_id(video_id: str, updates: Dict) -> bool:
+    """Update a row identified by `video_id`.
+
+    Returns True if a row was updated. The function applies `updates` to any
+    matching row and automatically sets `updated_at` to the current UTC time.
+    """
+    return update_inventory_batch({video_id: updates}) > 0
+
+
 def find_next_processed_pending() -> Dict | None:
     """Return the first processed video with status 'pending', or None."""
     lf = _read_inventory_lazy()
@@ -1,43 +1,152 @@
 """Video editor that applies random transformations to pending inventory items.
 
-The module selects the first pending raw clip, performs subtle zoom/color/speed
-adjustments, renders the transformed version into `videos/processed/`, and
-updates the inventory metadata accordingly.
+The module selects pending raw clips (the first one by default), performs
+subtle zoom/color/speed adjustments, renders the transformed versions into
+`videos/processed/`, and updates the inventory metadata accordingly.
+
+When an `ffmpeg` binary is on PATH all transformations are fused into a single
+FFmpeg filtergraph (one decode/encode pass, no per-frame Python); otherwise
+the MoviePy pipeline is used as a fallback.
 """
 
 from __future__ import annotations
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Optional, cast
+from typing import Any, Dict, Iterator, NamedTuple, Optional, cast
+import argparse
+import functools
+import os
 import random
-from datetime import datetime, timezone
+import shutil
+import subprocess
 from uuid import uuid4
 import polars as pl
 from moviepy.video.io.VideoFileClip import VideoFileClip
 from moviepy import vfx
+from moviepy.config import FFMPEG_BINARY as MOVIEPY_FFMPEG_BIN
 from scripts.common import (
     BASE_DIR,
     PROCESSED_DIR,
     ensure_dirs,
-    read_inventory,
-    update_inventory_by_video_id,
+    _now,
+    _read_inventory_lazy,
+    update_inventory_batch,
     logger,
 )
 from scripts.exceptions import VideoProcessingError
+from scripts.frame_kernels import mirror_x_and_saturate
 
 vfx_tool: Any = vfx
 
-def _select_first_pending_row(df: pl.DataFrame) -> Optional[Dict[str, Any]]:
-    """Return the first inventory row marked as pending."""
-    for row in df.to_dicts():
-        if row.get("status_fb") == "pending" and row.get("path_local"):
-            return row
-    return None
+FFMPEG_BIN: Optional[str] = shutil.which("ffmpeg")
+
+# FFmpeg filter per transformation, in filtergraph order
+_FFMPEG_FILTER_TEMPLATES = {
+    "mirror": "hflip",
+    # Centered 90% crop, rounded to even dimensions for yuv420p
+    "zoom": "crop=trunc(iw*0.45)*2:trunc(ih*0.45)*2",
+    "color": "eq=saturation={factor:.3f}",
+    "speed": "setpts=PTS/{factor:.3f}",
+}
+# Every encoder below outputs 4:2:0 chroma, which needs even frame sizes;
+# appended last so odd-sized sources (and odd MoviePy crops) still encode.
+_EVEN_SIZE_FILTER = "scale=trunc(iw/2)*2:trunc(ih/2)*2"
+# Random factor bounds for the templates that take one
+_FFMPEG_FACTOR_RANGES = {
+    "color": (0.85, 1.15),
+    "speed": (0.95, 1.05),
+}
+
+
+class _H264Encoder(NamedTuple):
+    codec: str
+    preset: Optional[str]
+    input_args: tuple[str, ...] = ()
+    filters: str = ""
+    output_args: tuple[str, ...] = ()
+
+
+_SOFTWARE_H264 = _H264Encoder("libx264", "veryfast", output_args=("-pix_fmt", "yuv420p"))
+
+# Dedicated encode blocks, in order of preference
+_HARDWARE_H264 = (
+    _H264Encoder(
+        "h264_nvenc",
+        "p4",
+        output_args=("-rc", "vbr", "-cq", "23", "-pix_fmt", "yuv420p"),
+    ),
+    _H264Encoder(
+        "h264_qsv",
+        "veryfast",
+        output_args=("-global_quality", "23", "-pix_fmt", "nv12"),
+    ),
+    _H264Encoder(
+        "h264_vaapi",
+        None,
+        input_args=("-vaapi_device", "/dev/dri/renderD128"),
+        filters="format=nv12,hwupload",
+        output_args=("-qp", "23"),
+    ),
+)
+
+
+def _encoder_works(ffmpeg_bin: str, encoder: _H264Encoder) -> bool:
+    """Encode a tiny synthetic clip to check the encoder is usable here.
+
+    `ffmpeg -encoders` lists hardware encoders that were compiled in even when
+    no device/driver is present, so a real probe is required.
+    """
+    cmd = [ffmpeg_bin, "-hide_banner", "-loglevel", "error", *encoder.input_args]
+    cmd += ["-f", "lavfi", "-i", "color=c=black:s=256x256:d=0.1"]
+    if encoder.filters:
+        cmd += ["-vf", encoder.filters]
+    cmd += ["-c:v", encoder.codec, "-f", "null", "-"]
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=30).returncode == 0
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def _select_h264_encoder(ffmpeg_bin: str, allow_filters: bool = True) -> _H264Encoder:
+    """Return the fastest working H.264 encoder for `ffmpeg_bin` (cached).
+
+    Falls back to `libx264`. MoviePy pipes raw RGB frames and always passes
+    `-preset`, so pass `allow_filters=False` to skip encoders that need an
+    upload filter or take no preset.
+    """
+    for encoder in _HARDWARE_H264:
+        if not allow_filters and (encoder.filters or encoder.preset is None):
+            continue
+        if _encoder_works(ffmpeg_bin, encoder):
+            logger.info("Using hardware H.264 encoder %s", encoder.codec)
+            return encoder
+    return _SOFTWARE_H264
+
+
+def _select_pending_rows(lf: pl.LazyFrame, limit: int = 1) -> list[Dict[str, Any]]:
+    """Return up to `limit` inventory rows marked as pending, in inventory order.
+
+    The filter and column selection are pushed down into the Parquet scan so
+    only the matching rows' `video_id`/`path_local` are decoded.
+    """
+    res = (
+        lf.filter(
+            (pl.col("status_fb") == "pending")
+            & pl.col("path_local").is_not_null()
+            & (pl.col("path_local") != "")
+        )
+        .select(["video_id", "path_local"])
+        .limit(limit)
+        .collect()
+    )
+    return res.to_dicts()
 
 
 def _build_output_path(src: Path) -> Path:
     """Generate a unique processed path based on the source filename."""
-    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    timestamp = _now().strftime("%Y%m%d%H%M%S")
     unique_suffix = uuid4().hex[:8]
     processed_name = f"{src.stem}_{timestamp}_{unique_suffix}{src.suffix}"
     PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
@@ -65,9 +174,14 @@ def _apply_random_transformations(clip: VideoFileClip) -> VideoFileClip:
         cropped = c.with_effects([vfx.Crop(x1=x_margin, y1=y_margin, x2=w - x_margin, y2=h - y_margin)])
         return cast(VideoFileClip, cropped)
 
-    def color(c: VideoFileClip) -> VideoFileClip:
-        logger.warning("Color transformation is not supported in the current version of moviepy. Skipping.")
-        return c
+    def color(c: VideoFileClip, mirror_too: bool = False) -> VideoFileClip:
+        factor = random.uniform(0.85, 1.15)
+        return c.image_transform(
+            lambda frame: mirror_x_and_saturate(frame, factor, mirror_too)
+        )
+
+    def mirror_and_color(c: VideoFileClip) -> VideoFileClip:
+        return color(c, mirror_too=True)
 
     def speed(c: VideoFileClip) -> VideoFileClip:
         logger.warning("Speed transformation is not supported in the current version of moviepy. Skipping.")
@@ -77,59 +191,79 @@ def _apply_random_transformations(clip: VideoFileClip) -> VideoFileClip:
 
     selection_size = random.randint(2, len(transformations))
     selected_transforms = random.sample(transformations, k=selection_size)
+    # Mirror and color both touch every pixel; run them as one fused pass.
+    if mirror in selected_transforms and color in selected_transforms:
+        selected_transforms.remove(color)
+        selected_transforms[selected_transforms.index(mirror)] = mirror_and_color
     transformed_clip = clip
     for transform in selected_transforms:
         transformed_clip = transform(transformed_clip)
     return transformed_clip
 
 
-def process_pending() -> int:
-    """Process the first pending raw video, apply transformations, and update inventory."""
+def _build_ffmpeg_filters() -> tuple[str, Optional[str]]:
+    """Pick at least two random transformations as FFmpeg filters.
 
-    ensure_dirs()
-    df = read_inventory()
-    row = _select_first_pending_row(df)
-    if not row:
-        logger.info("No pending videos found")
-        return 0
+    Returns the `-vf` filtergraph and, when the speed changes, the matching
+    `-af` filter that keeps audio in sync.
+    """
+    kinds = list(_FFMPEG_FILTER_TEMPLATES)
+    selected = set(random.sample(kinds, k=random.randint(2, len(kinds))))
+    factors = {
+        kind: random.uniform(*bounds)
+        for kind, bounds in _FFMPEG_FACTOR_RANGES.items()
+        if kind in selected
+    }
+    vf = ",".join(
+        template.format(factor=factors.get(kind))
+        for kind, template in _FFMPEG_FILTER_TEMPLATES.items()
+        if kind in selected
+    )
+    af = f"atempo={factors['speed']:.3f}" if "speed" in factors else None
+    return vf, af
 
-    path_local = row.get("path_local")
-    src = BASE_DIR / Path(cast(str, path_local))
-    if not src.exists():
-        logger.warning("Raw file not found for %s: %s", row.get("video_id"), src)
-        video_id = row.get("video_id")
-        if video_id is not None:
-            update_inventory_by_video_id(cast(str, video_id), {"status_fb": "failed"})
-        return 0
 
+def _select_render_encoder() -> _H264Encoder:
+    """Return the H.264 encoder the active renderer (FFmpeg or MoviePy) uses."""
+    if FFMPEG_BIN:
+        return _select_h264_encoder(FFMPEG_BIN)
+    return _select_h264_encoder(MOVIEPY_FFMPEG_BIN, allow_filters=False)
+
+
+def _render_with_ffmpeg(src: Path, dst: Path, encoder: _H264Encoder) -> None:
+    """Transform and encode `src` into `dst` with one FFmpeg invocation."""
+    ffmpeg_bin = cast(str, FFMPEG_BIN)
+    vf, af = _build_ffmpeg_filters()
+    vf = f"{vf},{_EVEN_SIZE_FILTER}"
+    if encoder.filters:
+        vf = f"{vf},{encoder.filters}"
+
+    cmd = [ffmpeg_bin, "-hide_banner", "-loglevel", "error", "-y", *encoder.input_args]
+    cmd += ["-i", str(src), "-vf", vf]
+    if af:
+        cmd += ["-af", af]
+    cmd += ["-c:v", encoder.codec]
+    if encoder.preset:
+        cmd += ["-preset", encoder.preset]
+    cmd += [*encoder.output_args, "-c:a", "aac", str(dst)]
+    subprocess.run(cmd, check=True)
+
+
+def _render_with_moviepy(src: Path, dst: Path, encoder: _H264Encoder) -> None:
+    """Fallback renderer used when no `ffmpeg` binary is on PATH."""
     clip: Optional[VideoFileClip] = None
     output_clip: Optional[VideoFileClip] = None
     try:
         clip = VideoFileClip(str(src))
         output_clip = _apply_random_transformations(clip)
-        dst = _build_output_path(src)
         output_clip.write_videofile(
-            str(dst), codec="libx264", audio_codec="aac", remove_temp=True
-        )
-
-        new_rel = str(dst.relative_to(BASE_DIR))
-        video_id = cast(str, row.get("video_id"))
-        update_inventory_by_video_id(
-            video_id,
-            {
-                "path_local": new_rel,
-                "status_fb": "ready",
-            },
+            str(dst),
+            codec=encoder.codec,
+            preset=cast(str, encoder.preset),
+            ffmpeg_params=["-vf", _EVEN_SIZE_FILTER, *encoder.output_args],
+            audio_codec="aac",
+            remove_temp=True,
         )
-
-        logger.info("Processed and transformed %s -> %s", src, dst)
-        return 1
-    except Exception as exc:
-        logger.exception("Failed to process video %s: %s", row.get("video_id"), exc)
-        video_id = row.get("video_id")
-        if video_id is not None:
-            update_inventory_by_video_id(cast(str, video_id), {"status_fb": "failed"})
-        raise VideoProcessingError(f"Failed to process video {row.get('video_id')}") from exc
     finally:
         if clip is not None:
             clip.close()
@@ -137,6 +271,115 @@ def process_pending() -> int:
             output_clip.close()
 
 
+def _default_workers() -> int:
+    # Each render holds decoded frame buffers; cap workers to avoid OOM.
+    return max(1, min((os.cpu_count() or 2) // 2, 4))
+
+
+def _process_one(row: Dict[str, Any], encoder: _H264Encoder) -> Optional[str]:
+    """Render one pending row with `encoder`; return the new relative path.
+
+    Returns None when the raw file is missing. Runs inside pool workers, so it
+    never touches the inventory itself.
+    """
+    src = BASE_DIR / Path(cast(str, row.get("path_local")))
+    if not src.exists():
+        logger.warning("Raw file not found for %s: %s", row.get("video_id"), src)
+        return None
+
+    dst = _build_output_path(src)
+    if FFMPEG_BIN:
+        _render_with_ffmpeg(src, dst, encoder)
+    else:
+        _render_with_moviepy(src, dst, encoder)
+    logger.info("Processed and transformed %s -> %s", src, dst)
+    return str(dst.relative_to(BASE_DIR))
+
+
+def _run_jobs(
+    rows: list[Dict[str, Any]], workers: int, encoder: _H264Encoder
+) -> Iterator[tuple[Dict[str, Any], Optional[str], Optional[Exception]]]:
+    """Yield `(row, new_rel, error)` for each row, in input order."""
+    if workers <= 1:
+        for row in rows:
+            try:
+                yield row, _process_one(row, encoder), None
+            except Exception as exc:  # pylint: disable=broad-except
+                yield row, None, exc
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(row, pool.submit(_process_one, row, encoder)) for row in rows]
+        for row, future in futures:
+            try:
+                yield row, future.result(), None
+            except Exception as exc:  # pylint: disable=broad-except
+                yield row, None, exc
+
+
+def process_pending(limit: int = 1, max_workers: Optional[int] = None) -> int:
+    """Process up to `limit` pending raw videos and update the inventory.
+
+    With more than one pending clip the renders run in a process pool of
+    `max_workers` (default: half the cores, at most 4). All outcomes are
+    committed to the inventory in one batch update once every render has
+    finished. Returns the number of clips processed; raises
+    `VideoProcessingError` after all clips have been attempted if any render
+    failed.
+    """
+
+    ensure_dirs()
+    rows = _select_pending_rows(_read_inventory_lazy(), limit)
+    if not rows:
+        logger.info("No pending videos found")
+        return 0
+
+    workers = min(len(rows), max_workers or _default_workers())
+    # Probe once here; pool workers don't share the lru_cache and would each
+    # re-run one ffmpeg subprocess per hardware candidate.
+    encoder = _select_render_encoder()
+    processed = 0
+    first_failure: Optional[tuple[str, Exception]] = None
+    updates: Dict[str, Dict[str, Any]] = {}
+    for row, new_rel, exc in _run_jobs(rows, workers, encoder):
+        video_id = cast(str, row.get("video_id"))
+        if exc is not None:
+            logger.error(
+                "Failed to process video %s: %s", video_id, exc, exc_info=exc
+            )
+            if first_failure is None:
+                first_failure = (video_id, exc)
+        if new_rel is None:
+            updates[video_id] = {"status_fb": "failed"}
+            continue
+
+        updates[video_id] = {
+            "path_local": new_rel,
+            "status_fb": "ready",
+        }
+        processed += 1
+
+    # Commit every outcome with a single inventory rewrite
+    update_inventory_batch(updates)
+
+    if first_failure is not None:
+        video_id, exc = first_failure
+        raise VideoProcessingError(f"Failed to process video {video_id}") from exc
+    return processed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--limit", type=int, default=1, help="Maximum pending videos to process"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Parallel render processes"
+    )
+    args = parser.parse_args()
+    process_pending(limit=args.limit, max_workers=args.workers)
+
+
 if __name__ == "__main__":
-    # Run the single-shot processing; logging will record the outcome.
-    process_pending()
+    # Defaults to single-shot processing; logging will record the outcome.
+    main()
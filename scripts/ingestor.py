@@ -5,27 +5,36 @@ This module provides small, testable functions that:
 - download videos into the `videos/raw/` folder using yt-dlp
 - add entries to the inventory with `status_fb = 'pending'`
 
+`ingest` handles one source per call; `ingest_many` fans several sources out
+over a thread pool and appends all new rows in one inventory write.
+
 Note: The download step uses yt-dlp programmatically; ensure the package is
 installed and Playwright/other browsers are set up when needed.
 """
 
 from __future__ import annotations
 
-from datetime import datetime, timezone
-from typing import List, cast, Any
+import argparse
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
 from scripts.exceptions import DownloadError, InventoryUpdateError
 from scripts.utils import random_wait, retry
 
 from fake_useragent import UserAgent
 from yt_dlp import YoutubeDL
-import polars as pl
 
 from scripts.common import (
     BASE_DIR,
     RAW_DIR,
     ensure_dirs,
-    _read_inventory_lazy,
+    _inventory_signature,
+    _load_existing_ids,
     _append_to_inventory,
+    BatchInventoryWriter,
     logger,
 )
 
@@ -35,6 +44,13 @@ DEFAULT_USER_AGENT = (
     "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
 )
 
+# Upper bound in seconds for one video's download attempts plus backoff, so
+# a stalled source cannot hold a pool worker through every retry
+DOWNLOAD_RETRY_BUDGET = 600.0
+
+# Serializes candidate selection so concurrent sources never claim one video
+_CLAIM_LOCK = threading.Lock()
+
 
 def obtener_tendencias(source: str | None = None) -> List[str]:
     """Return a list of video URLs to ingest.
@@ -55,80 +71,97 @@ def procesar_hashtag(hashtag: str) -> List[str]:
     return []
 
 
+def _list_video_urls(source: str, user_agent: str) -> List[str]:
+    """Flat-list `source` with yt-dlp and return the video URLs it contains."""
+    opts: Dict[str, Any] = {
+        "extract_flat": True,
+        "noplaylist": True,
+        "user_agent": user_agent,
+    }
+    with YoutubeDL(opts) as ydl:
+        listing = ydl.extract_info(source, download=False)
+    entries = listing.get("entries") or [listing]
+    return [
+        url for entry in entries if (url := entry.get("url") or entry.get("webpage_url"))
+    ]
+
+
+async def obtener_tendencias_async(
+    sources: Iterable[str], concurrency: int = 8
+) -> List[str]:
+    """Expand listing/hashtag/video URLs into video URLs, `concurrency` at a time.
+
+    Each source is flat-listed on a worker thread; a source that fails to
+    list is logged and contributes nothing. URLs keep source order and are
+    de-duplicated, ready to hand to `ingest_many`.
+    """
+    user_agent = _resolve_user_agent()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _expand(source: str) -> List[str]:
+        async with semaphore:
+            try:
+                return await asyncio.to_thread(_list_video_urls, source, user_agent)
+            except Exception as exc:  # pylint: disable=broad-except
+                logger.warning("Failed to list %s: %s", source, exc)
+                return []
+
+    async with asyncio.TaskGroup() as tg:
+        tasks = [tg.create_task(_expand(source)) for source in sources if source]
+    return list(dict.fromkeys(url for task in tasks for url in task.result()))
+
+
+@functools.lru_cache(maxsize=1)
+def _user_agent_source() -> UserAgent:
+    # Constructing UserAgent parses its bundled browser database; do it once.
+    # A failed construction raises and is not cached, so the next call retries.
+    return UserAgent()
+
+
 def _resolve_user_agent() -> str:
     try:
-        return UserAgent().random
+        return _user_agent_source().random
     except Exception as exc:  # pylint: disable=broad-except
         logger.warning("Falling back to default User-Agent: %s", exc)
         return DEFAULT_USER_AGENT
 
 
-def _already_exists(video_id: str) -> bool:
-    lf = _read_inventory_lazy()
-    exists = (
-        lf.filter(pl.col("video_id") == video_id)
-        .select(pl.col("video_id"))
-        .limit(1)
-        .collect()
-    )
-    return exists.height > 0
-
+def _existing_video_ids() -> set[str]:
+    """Return a mutable copy of the known ids for one ingest run.
 
-def ingest(source_url: str, retries: int = 3) -> None:
-    """Single-shot ingestion: download at most one new video for `source_url`."""
-    if not source_url:
-        logger.warning("No source_url provided to ingest()")
-        return
+    A missing inventory has no ids; it is created by the first append, so
+    nothing is written or scanned here on a cold start.
+    """
+    return set(_load_existing_ids(_inventory_signature()))
 
-    ensure_dirs()
-    RAW_DIR.mkdir(parents=True, exist_ok=True)
 
-    user_agent = _resolve_user_agent()
+def _find_downloaded_file(info: Dict[str, Any], ydl: YoutubeDL) -> Optional[Path]:
+    """Return the file yt-dlp wrote for `info` without listing RAW_DIR.
 
-    listing_opts = {
+    `requested_downloads` carries the final (post-merge) path; otherwise the
+    output template is rendered for `info`.
+    """
+    downloads = info.get("requested_downloads") or [{}]
+    filepath = downloads[0].get("filepath") or ydl.prepare_filename(info)
+    return Path(filepath) if filepath else None
+
+
+def _download_one(
+    source_url: str,
+    user_agent: str,
+    existing_ids: set[str],
+    retries: int = 3,
+) -> Optional[Dict[str, Any]]:
+    """List `source_url`, download its first new video and return the row.
+
+    Returns None when there is nothing new to download. The chosen id is added
+    to `existing_ids` so concurrent calls sharing the set never pick the same
+    video. Raises `DownloadError` when listing or downloading fails.
+    """
+    # One YoutubeDL serves both phases so the extractor registry, cookie jar
+    # and HTTP connections set up for the listing are reused by the download.
+    opts: Dict[str, Any] = {
         "extract_flat": True,
-        "skip_download": True,
-        "noplaylist": True,
-        "user_agent": user_agent,
-        # human-like ytdlp sleep hints
-        "sleep_interval": 3,
-        "max_sleep_interval": 10,
-        "sleep_subtitles": 1,
-    }
-
-    try:
-        random_wait(1, 6)
-        with YoutubeDL(cast(Any, listing_opts)) as ydl:
-            listing = ydl.extract_info(source_url, download=False)
-    except Exception as exc:
-        logger.exception("Failed to fetch listing for %s: %s", source_url, exc)
-        raise DownloadError(f"Failed to fetch listing for {source_url}") from exc
-
-    entries = cast(list, listing.get("entries")) if listing.get("entries") is not None else []
-    if not entries and listing.get("id") is not None:
-        entries = [listing]
-
-    target_entry = None
-    for entry in entries:
-        video_id = cast(str, entry.get("id")) if entry.get("id") is not None else None
-        entry_url = entry.get("url") or entry.get("webpage_url")
-        if not video_id or not entry_url:
-            continue
-        if _already_exists(video_id):
-            continue
-        target_entry = entry
-        break
-
-    if not target_entry:
-        logger.info("No new videos found")
-        return
-
-    target_url = target_entry.get("url") or target_entry.get("webpage_url")
-    if not target_url:
-        logger.warning("Candidate video missing URL, skipping download")
-        return
-
-    download_opts = {
         "outtmpl": str(RAW_DIR / "%(id)s.%(ext)s"),
         "format": "bestvideo+bestaudio/best",
         "noplaylist": True,
@@ -138,36 +171,80 @@ def ingest(source_url: str, retries: int = 3) -> None:
         "max_sleep_interval": 10,
         "sleep_subtitles": 1,
     }
-    # ensure we have a video_id for status updates
-    video_id = cast(str, target_entry.get("id")) if target_entry.get("id") is not None else None
-
-    def _do_download():
-        with YoutubeDL(cast(Any, download_opts)) as ydl:
-            return ydl.extract_info(target_url, download=True)
-
-    try:
-        random_wait(1, 6)
-        # decorate the small helper with retry behavior
-        info = retry(retries=retries, base=5.0, factor=3.0, max_wait=90.0, jitter=True)(_do_download)()
-    except Exception as exc:
-        logger.error("Download failed for %s after retries: %s", target_url, exc)
-        from scripts.common import update_inventory_by_video_id
-        if video_id:
-            try:
-                update_inventory_by_video_id(video_id, {"status_fb": "failed"})
-            except Exception as update_exc:
-                logger.error("Failed to mark video %s as failed in inventory: %s", video_id, update_exc)
-        raise DownloadError(f"Failed to download {target_url} after {retries} attempts") from exc
 
-    video_id = cast(str, info.get("id")) if info.get("id") is not None else (
-        cast(str, target_entry.get("id")) if target_entry.get("id") is not None else None
-    )
+    with YoutubeDL(opts) as ydl:
+        try:
+            random_wait(1, 6)
+            listing = ydl.extract_info(source_url, download=False)
+        except Exception as exc:
+            logger.exception("Failed to fetch listing for %s: %s", source_url, exc)
+            raise DownloadError(f"Failed to fetch listing for {source_url}") from exc
+
+        entries = listing.get("entries") or []
+        if not entries and listing.get("id"):
+            entries = [listing]
+
+        with _CLAIM_LOCK:
+            # first entry with an id and URL that is not in the inventory yet
+            target_entry = next(
+                (
+                    entry
+                    for entry in entries
+                    if entry.get("id")
+                    and entry.get("id") not in existing_ids
+                    and (entry.get("url") or entry.get("webpage_url"))
+                ),
+                None,
+            )
+            if target_entry:
+                existing_ids.add(target_entry["id"])
+
+        if not target_entry:
+            logger.info("No new videos found")
+            return None
+
+        target_url = target_entry.get("url") or target_entry.get("webpage_url")
+        if not target_url:
+            logger.warning("Candidate video missing URL, skipping download")
+            return None
+
+        # ensure we have a video_id for status updates
+        video_id = target_entry.get("id")
+
+        # switch the shared instance from flat listing to a full download
+        ydl.params["extract_flat"] = False
+
+        def _do_download():
+            info = ydl.extract_info(target_url, download=True)
+            return info, _find_downloaded_file(info, ydl)
+
+        try:
+            random_wait(1, 6)
+            # decorate the small helper with retry behavior
+            info, downloaded = retry(
+                retries=retries,
+                base=5.0,
+                factor=3.0,
+                max_wait=90.0,
+                jitter=True,
+                total_budget=DOWNLOAD_RETRY_BUDGET,
+            )(_do_download)()
+        except Exception as exc:
+            logger.error("Download failed for %s after retries: %s", target_url, exc)
+            from scripts.common import update_inventory_by_video_id
+            if video_id:
+                try:
+                    update_inventory_by_video_id(video_id, {"status_fb": "failed"})
+                except Exception as update_exc:
+                    logger.error("Failed to mark video %s as failed in inventory: %s", video_id, update_exc)
+            raise DownloadError(f"Failed to download {target_url} after {retries} attempts") from exc
+
+    video_id = info.get("id") or video_id
     if not video_id:
         logger.warning("Downloaded video missing ID, skipping inventory append")
-        return
+        return None
 
-    matches = list(RAW_DIR.glob(f"{video_id}.*"))
-    path_local = str(matches[0].relative_to(BASE_DIR)) if matches else ""
+    path_local = str(downloaded.relative_to(BASE_DIR)) if downloaded else ""
 
     row = {
         "video_id": video_id,
@@ -178,10 +255,28 @@ def ingest(source_url: str, retries: int = 3) -> None:
         "duration": int(info.get("duration") or 0),
         "path_local": path_local,
         "status_fb": "pending",
-        "created_at": datetime.now(timezone.utc),
-        "updated_at": datetime.now(timezone.utc),
+        # created_at / updated_at are stamped once per batch on append
     }
+    return row
+
+
+def ingest(source_url: str, retries: int = 3) -> None:
+    """Single-shot ingestion: download at most one new video for `source_url`."""
+    if not source_url:
+        logger.warning("No source_url provided to ingest()")
+        return
+
+    ensure_dirs()
+    RAW_DIR.mkdir(parents=True, exist_ok=True)
 
+    # One scan for all candidates instead of one query per entry
+    row = _download_one(
+        source_url, _resolve_user_agent(), _existing_video_ids(), retries
+    )
+    if row is None:
+        return
+
+    video_id = row["video_id"]
     try:
         _append_to_inventory([row])
     except Exception as exc:
@@ -191,3 +286,85 @@ def ingest(source_url: str, retries: int = 3) -> None:
     logger.info("Downloaded %s", video_id)
 
 
+async def ingest_many(
+    source_urls: Iterable[str], concurrency: int = 4, retries: int = 3
+) -> int:
+    """Ingest at most one new video per source URL, `concurrency` at a time.
+
+    yt-dlp is blocking, so each source runs `_download_one` on a thread pool
+    driven by an asyncio TaskGroup. A failing source is logged and skipped.
+    All new rows are appended with a single inventory write. Returns the
+    number of videos ingested.
+    """
+    urls = [url for url in source_urls if url]
+    if not urls:
+        logger.warning("No source_urls provided to ingest_many()")
+        return 0
+
+    ensure_dirs()
+    RAW_DIR.mkdir(parents=True, exist_ok=True)
+
+    user_agent = _resolve_user_agent()
+    existing_ids = _existing_video_ids()
+    loop = asyncio.get_running_loop()
+
+    async def _run(pool: ThreadPoolExecutor, url: str, writer: BatchInventoryWriter) -> None:
+        try:
+            row = await loop.run_in_executor(
+                pool, _download_one, url, user_agent, existing_ids, retries
+            )
+        except DownloadError as exc:
+            logger.error("Skipping %s: %s", url, exc)
+            return
+        except Exception as exc:  # pylint: disable=broad-except
+            # Escaping the TaskGroup would cancel the other downloads and
+            # drop the rows already collected in `writer`.
+            logger.exception("Skipping %s after unexpected error: %s", url, exc)
+            return
+        if row is not None:
+            writer.add(row)
+
+    writer = BatchInventoryWriter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        async with asyncio.TaskGroup() as tg:
+            for url in urls:
+                tg.create_task(_run(pool, url, writer))
+
+    if not writer:
+        return 0
+
+    ids = [row["video_id"] for row in writer.rows]
+    try:
+        writer.flush()
+    except Exception as exc:
+        logger.exception("Failed to update inventory for %s: %s", ids, exc)
+        raise InventoryUpdateError(f"Failed to update inventory for {ids}") from exc
+
+    logger.info("Downloaded %d videos: %s", len(ids), ids)
+    return len(ids)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source_urls", nargs="+", help="Listing or video URLs")
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="Parallel downloads"
+    )
+    parser.add_argument(
+        "--expand",
+        action="store_true",
+        help="List every source first and ingest each video it contains",
+    )
+    args = parser.parse_args()
+
+    if args.expand:
+        urls = asyncio.run(obtener_tendencias_async(args.source_urls))
+        asyncio.run(ingest_many(urls, concurrency=args.concurrency))
+    elif len(args.source_urls) == 1:
+        ingest(args.source_urls[0])
+    else:
+        asyncio.run(ingest_many(args.source_urls, concurrency=args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,16 +10,17 @@ videos as posted after successful uploads.
 from __future__ import annotations
 
 import argparse
+import os
 from typing import Optional
-from pathlib import Path
 
 from filelock import FileLock
-from datetime import datetime, timezone
 
 from scripts.common import (
     BASE_DIR,
     INVENTORY_PATH,
     LOCK_PATH,
+    _now,
+    _sink_inventory,
     update_inventory_by_video_id,
     logger,
 )
@@ -41,39 +42,41 @@ def cli_get_next() -> Optional[str]:
         with lock:
             if not INVENTORY_PATH.exists():
                 return None
-            df = pl.read_parquet(INVENTORY_PATH)
+            lf = pl.scan_parquet(str(INVENTORY_PATH))
             found_path: Optional[str] = None
-            for row in df.to_dicts():
-                if row.get("status_fb") != "pending":
-                    continue
-                path_local = row.get("path_local") or ""
-                if "processed" not in path_local:
-                    continue
-                candidate = BASE_DIR / Path(path_local)
-                if candidate.exists():
+            # filter in Polars so only processed pending rows reach Python
+            pending = (
+                lf.filter(
+                    (pl.col("status_fb") == "pending")
+                    & pl.col("path_local").str.contains("processed", literal=True)
+                )
+                .select(["video_id", "path_local"])
+                .collect()
+            )
+            for video_id, path_local in zip(pending["video_id"], pending["path_local"]):
+                candidate = os.path.join(BASE_DIR, path_local)
+                if os.path.exists(candidate):
                     found_path = path_local
                     # don't return yet; allow marking of earlier missing files
                     break
-                # mark as failed in the in-memory DF (we're holding the lock)
-                logger.error(
-                    "Processed file missing for %s: %s", row.get("video_id"), candidate
-                )
-                to_mark_failed.append(row.get("video_id"))
+                # collect for a single rewrite below (we're holding the lock)
+                logger.error("Processed file missing for %s: %s", video_id, candidate)
+                to_mark_failed.append(video_id)
 
             if to_mark_failed:
-                # update status_fb and updated_at for the missing entries
+                # update status_fb and updated_at for the missing entries,
+                # sharing one membership mask and one timestamp
+                mask = pl.col("video_id").is_in(to_mark_failed)
+                ts = pl.lit(_now())
                 exprs = [
-                    pl.when(pl.col("video_id").is_in(to_mark_failed))
+                    pl.when(mask)
                     .then(pl.lit("failed"))
                     .otherwise(pl.col("status_fb"))
                     .alias("status_fb"),
-                    pl.when(pl.col("video_id").is_in(to_mark_failed))
-                    .then(pl.lit(datetime.now(timezone.utc)))
-                    .otherwise(pl.col("updated_at"))
-                    .alias("updated_at"),
+                    pl.when(mask).then(ts).otherwise(pl.col("updated_at")).alias("updated_at"),
                 ]
-                df = df.with_columns(exprs)
-                df.write_parquet(INVENTORY_PATH)
+                # stream the rewrite into a temp file and swap it in atomically
+                _sink_inventory(lf.with_columns(exprs))
             if found_path:
                 return found_path
     except Exception:
@@ -1,9 +1,10 @@
 """Utilities: human-like waits and retry decorator.
 
 Provide `random_wait(min_seconds, max_seconds)` to simulate human delays
-and a `retry` decorator implementing exponential backoff with jitter.
-These helpers honor the `SKIP_WAITS` environment variable to bypass
-sleeping during tests or CI when desired.
+and a `retry` decorator implementing exponential backoff with jitter and an
+optional total time budget. These helpers honor the
+`SKIP_WAITS` environment variable (read once at import, see
+`set_skip_waits`) to bypass sleeping during tests or CI when desired.
 """
 from __future__ import annotations
 
@@ -11,14 +12,21 @@ import os
 import random
 import time
 import functools
-from typing import Callable, Any
+from typing import Callable, Any, Iterator, Optional
 
 
-def _skip_waits() -> bool:
-    val = os.environ.get("SKIP_WAITS")
-    if val is None:
-        return False
-    return val.lower() in ("1", "true", "yes")
+def _env_skip_waits() -> bool:
+    return os.environ.get("SKIP_WAITS", "").lower() in ("1", "true", "yes")
+
+
+# Read once at import; the env var is set before the process starts
+_SKIP_WAITS = _env_skip_waits()
+
+
+def set_skip_waits(value: bool | None = None) -> None:
+    """Override the cached `SKIP_WAITS` flag (None re-reads the environment)."""
+    global _SKIP_WAITS
+    _SKIP_WAITS = _env_skip_waits() if value is None else bool(value)
 
 
 def random_wait(min_seconds: float = 1.0, max_seconds: float = 6.0) -> None:
@@ -26,10 +34,36 @@ def random_wait(min_seconds: float = 1.0, max_seconds: float = 6.0) -> None:
 
     If `SKIP_WAITS` is set in the environment, this is a no-op.
     """
-    if _skip_waits():
+    if _SKIP_WAITS:
         return
-    wait = random.uniform(float(min_seconds), float(max_seconds))
-    time.sleep(wait)
+    time.sleep(min_seconds + (max_seconds - min_seconds) * random.random())
+
+
+def _backoff_waits(
+    retries: int,
+    base: float,
+    factor: float,
+    max_wait: float,
+    jitter: bool,
+    deadline: Optional[float],
+) -> Iterator[float]:
+    """Yield the sleep before each retry (`retries - 1` values at most).
+
+    Stops early once the next sleep would end past `deadline`, a
+    `time.monotonic()` timestamp.
+    """
+    nominal = base
+    for _ in range(retries - 1):
+        wait = min(nominal, max_wait)
+        nominal *= factor
+        if jitter:
+            # apply small +/- 10% jitter
+            jitter_amount = wait * 0.1
+            wait = wait + random.uniform(-jitter_amount, jitter_amount)
+        wait = max(0.0, wait)
+        if deadline is not None and time.monotonic() + wait > deadline:
+            return
+        yield wait
 
 
 def retry(
@@ -38,11 +72,14 @@ def retry(
     factor: float = 3.0,
     max_wait: float = 90.0,
     jitter: bool = True,
+    total_budget: Optional[float] = None,
 ) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
     """Decorator to retry a function with exponential backoff and jitter.
 
     Example backoff sequence with base=5 and factor=3: 5, 15, 45, ...
-    A small jitter (±10%) is applied when `jitter=True`.
+    A small jitter (±10%) is applied when `jitter=True`. With `total_budget`
+    set, no retry is started whose wait would exceed that many seconds in
+    total; the last exception is raised instead.
 
     If `SKIP_WAITS` is set, sleeping between retries is skipped.
     """
@@ -50,25 +87,19 @@ def retry(
     def _decorator(func: Callable[..., Any]) -> Callable[..., Any]:
         @functools.wraps(func)
         def _wrapper(*args, **kwargs):
-            last_exc = None
-            for attempt in range(1, retries + 1):
+            # The budget covers the attempts too, so start it before the first
+            deadline = None if total_budget is None else time.monotonic() + total_budget
+            waits = _backoff_waits(retries, base, factor, max_wait, jitter, deadline)
+            while True:
                 try:
                     return func(*args, **kwargs)
-                except Exception as exc:  # pylint: disable=broad-except
-                    last_exc = exc
-                    if attempt >= retries:
-                        break
-                    wait = base * (factor ** (attempt - 1))
-                    if wait > max_wait:
-                        wait = max_wait
-                    if jitter:
-                        # apply small +/- 10% jitter
-                        jitter_amount = wait * 0.1
-                        wait = wait + random.uniform(-jitter_amount, jitter_amount)
-                    if not _skip_waits():
-                        time.sleep(max(0.0, wait))
-            # Retries exhausted
-            raise last_exc
+                except Exception:  # pylint: disable=broad-except
+                    wait = next(waits, None)
+                    if wait is None:
+                        # Retries or budget exhausted
+                        raise
+                    if not _SKIP_WAITS:
+                        time.sleep(wait)
 
         return _wrapper
 
@@ -0,0 +1,129 @@
+"""Fixtures shared by the test modules.
+
+Plain helpers and test doubles live in `tests.helpers`. Pipeline modules
+other than `common` are imported inside the fixtures that patch them, so a
+test module only pays for the imports it actually uses.
+"""
+
+import pytest
+
+import scripts.common as common
+from tests.helpers import _NOW
+
+
+@pytest.fixture
+def frozen_now(monkeypatch):
+    """Make the pipeline clock (`common._now`) return `_NOW`."""
+    monkeypatch.setattr(common, "_now", lambda: _NOW)
+    return _NOW
+
+
+@pytest.fixture(scope="session")
+def empty_inventory_bytes(tmp_path_factory):
+    """Bytes of an empty inventory as `ensure_inventory` writes it, built once."""
+    template = tmp_path_factory.mktemp("tpl") / "inv.parquet"
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(common, "INVENTORY_PATH", template)
+        mp.setattr(common, "LOCK_PATH", template.with_suffix(".lock"))
+        mp.setattr(common, "_inventory_checked", False)
+        common.ensure_inventory()
+    return template.read_bytes()
+
+
+@pytest.fixture(scope="session")
+def project_layout(tmp_path_factory):
+    """Build the temporary project tree once per session.
+
+    `paths` maps the module-level path constants to their location in the
+    tree and `patches` caches the `(module, name, value)` triples resolved
+    from it per module set; the remaining keys are shortcuts for the tests.
+    """
+    base_dir = tmp_path_factory.mktemp("project")
+    data_dir = base_dir / "data"
+    videos_dir = base_dir / "videos"
+    raw_dir = videos_dir / "raw"
+    processed_dir = videos_dir / "processed"
+    logs_dir = base_dir / "logs"
+
+    for path in (data_dir, raw_dir, processed_dir, logs_dir):
+        path.mkdir(parents=True, exist_ok=True)
+
+    inventory_path = data_dir / "inventario_videos.parquet"
+    lock_path = data_dir / "inventario.lock"
+
+    return {
+        "paths": {
+            "BASE_DIR": base_dir,
+            "DATA_DIR": data_dir,
+            "VIDEOS_DIR": videos_dir,
+            "RAW_DIR": raw_dir,
+            "PROCESSED_DIR": processed_dir,
+            "LOGS_DIR": logs_dir,
+            "INVENTORY_PATH": inventory_path,
+            "LOCK_PATH": lock_path,
+            "LOG_FILE": logs_dir / "pipeline.log",
+        },
+        "patches": {},
+        "base_dir": base_dir,
+        "raw_dir": raw_dir,
+        "processed_dir": processed_dir,
+        "inventory_path": inventory_path,
+        "lock_path": lock_path,
+        "rel": lambda path: str(path.relative_to(base_dir)),
+    }
+
+
+@pytest.fixture
+def use_layout(project_layout, monkeypatch):
+    """Return a helper that points modules at the shared tree and empties it.
+
+    `common` is always patched, plus every module passed in, for each path
+    constant it defines. The inventory file and any leftover videos from the
+    previous test are removed.
+    """
+
+    def _use(*modules):
+        key = (common, *modules)
+        patches = project_layout["patches"].get(key)
+        if patches is None:
+            # Resolved once per session for each module set
+            patches = project_layout["patches"][key] = [
+                (module, name, value)
+                for module in key
+                for name, value in project_layout["paths"].items()
+                if hasattr(module, name)
+            ]
+        for module, name, value in patches:
+            monkeypatch.setattr(module, name, value)
+
+        for folder in (project_layout["raw_dir"], project_layout["processed_dir"]):
+            for leftover in folder.iterdir():
+                leftover.unlink()
+        project_layout["inventory_path"].unlink(missing_ok=True)
+        return project_layout
+
+    return _use
+
+
+@pytest.fixture
+def temp_env_paths(use_layout, empty_inventory_bytes, monkeypatch):
+    import scripts.editor as editor
+
+    layout = use_layout(editor)
+    layout["inventory_path"].write_bytes(empty_inventory_bytes)
+
+    # Exercise the MoviePy renderer by default; FFmpeg is tested explicitly
+    monkeypatch.setattr(editor, "FFMPEG_BIN", None)
+    # Never probe real hardware encoders from the unit tests
+    monkeypatch.setattr(
+        editor, "_select_h264_encoder", lambda *args, **kwargs: editor._SOFTWARE_H264
+    )
+
+    return layout
+
+
+@pytest.fixture
+def tmp_env(use_layout, empty_inventory_bytes):
+    import scripts.ingestor as ingestor
+
+    use_layout(ingestor)["inventory_path"].write_bytes(empty_inventory_bytes)
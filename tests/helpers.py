@@ -0,0 +1,77 @@
+"""Plain helpers and test doubles shared by the test modules."""
+
+import io
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+import polars as pl
+
+import scripts.common as common
+
+
+# The production inventory schema; passing it skips Polars' type inference
+INVENTORY_SCHEMA = dict(common.INVENTORY_COLUMNS)
+
+# Fixed clock for inventory rows so timestamps compare exactly
+_NOW = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def write_inventory(path, rows):
+    """Write `rows` as the inventory parquet at `path`.
+
+    Test inventories are tiny, so compression and column statistics are
+    skipped; readers never depend on either.
+    """
+    buf = io.BytesIO()
+    pl.DataFrame(rows, schema=INVENTORY_SCHEMA).write_parquet(
+        buf, compression="uncompressed", statistics=False
+    )
+    path.write_bytes(buf.getvalue())
+
+
+def _to_aware(dt: datetime) -> datetime:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+class DummyYDL:
+    def __init__(self, opts, *, listing=None, download=None):
+        self.opts = opts
+        self.params = dict(opts)
+        self._listing = listing
+        self._download = download
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def extract_info(self, url, download=False):
+        if download:
+            return self._download
+        return self._listing
+
+    def prepare_filename(self, info):
+        return self.opts["outtmpl"] % {"id": info["id"], "ext": info.get("ext", "mp4")}
+
+
+@dataclass(slots=True)
+class FakeClip:
+    """Just enough of a MoviePy clip for the transformation helpers."""
+
+    w: int = 1920
+    h: int = 1080
+    size: tuple = (1920, 1080)
+    calls: list = field(default_factory=list)
+
+    def with_effects(self, effects):
+        self.calls.append("with_effects")
+        return self
+
+    def image_transform(self, func):
+        self.calls.append("image_transform")
+        return self
@@ -1,54 +1,41 @@
-from datetime import datetime, timezone
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, Mock, patch
 
+import numpy as np
 import polars as pl
 import pytest
 from scripts.exceptions import VideoProcessingError
 
 import scripts.common as common
 import scripts.editor as editor
+from tests.helpers import _NOW, INVENTORY_SCHEMA, FakeClip, write_inventory
 
+# The `vfx_tool` effects editor.py calls; spec_set rejects anything else
+_VFX_EFFECTS = ("MirrorX",)
 
-@pytest.fixture
-def temp_env_paths(tmp_path, monkeypatch):
-    base_dir = tmp_path / "project"
-    data_dir = base_dir / "data"
-    videos_dir = base_dir / "videos"
-    raw_dir = videos_dir / "raw"
-    processed_dir = videos_dir / "processed"
-    logs_dir = base_dir / "logs"
-
-    for path in (data_dir, raw_dir, processed_dir, logs_dir):
-        path.mkdir(parents=True, exist_ok=True)
-
-    inventory_path = data_dir / "inventario_videos.parquet"
-    lock_path = data_dir / "inventario.lock"
-    log_file = logs_dir / "pipeline.log"
-
-    patched_paths = {
-        "BASE_DIR": base_dir,
-        "DATA_DIR": data_dir,
-        "VIDEOS_DIR": videos_dir,
-        "RAW_DIR": raw_dir,
-        "PROCESSED_DIR": processed_dir,
-        "LOGS_DIR": logs_dir,
-        "INVENTORY_PATH": inventory_path,
-        "LOCK_PATH": lock_path,
-        "LOG_FILE": log_file,
-    }
 
-    for module in (common, editor):
-        for name, value in patched_paths.items():
-            if hasattr(module, name):
-                monkeypatch.setattr(module, name, value)
+def _vfx_mock(clip):
+    vfx_mock = Mock(spec_set=_VFX_EFFECTS)
+    vfx_mock.configure_mock(**{name: Mock(return_value=clip) for name in _VFX_EFFECTS})
+    return vfx_mock
 
-    return {
-        "base_dir": base_dir,
-        "raw_dir": raw_dir,
-        "processed_dir": processed_dir,
-        "inventory_path": inventory_path,
-    }
+
+# An inventory whose only video is already processed
+_READY_DF = pl.DataFrame(
+    [
+        {
+            "video_id": "vid999",
+            "source_url": "https://example.com/already.mp4",
+            "title": "Ready",
+            "duration": 84,
+            "path_local": "videos/processed/ready.mp4",
+            "status_fb": "ready",
+            "created_at": _NOW,
+            "updated_at": _NOW,
+        }
+    ],
+    schema=INVENTORY_SCHEMA,
+)
 
 
 def test_process_pending_transforms_single_clip(temp_env_paths, monkeypatch):
@@ -56,7 +43,7 @@ def test_process_pending_transforms_single_clip(temp_env_paths, monkeypatch):
     raw_file.write_bytes(b"raw")
     path_local = raw_file.relative_to(temp_env_paths["base_dir"])
 
-    now = datetime.now(timezone.utc)
+    now = _NOW
     inventory_row = {
         "video_id": "vid123",
         "source_url": "https://example.com/video.mp4",
@@ -67,7 +54,7 @@ def test_process_pending_transforms_single_clip(temp_env_paths, monkeypatch):
         "created_at": now,
         "updated_at": now,
     }
-    pl.DataFrame([inventory_row]).write_parquet(temp_env_paths["inventory_path"])
+    write_inventory(temp_env_paths["inventory_path"], [inventory_row])
 
     clip_mock = MagicMock(name="clip")
     clip_mock.w = 1920
@@ -81,13 +68,7 @@ def test_process_pending_transforms_single_clip(temp_env_paths, monkeypatch):
     clip_mock.resize = MagicMock(return_value=clip_mock)
 
     # Mock vfx_tool functions to return the clip unchanged
-    vfx_mock = MagicMock()
-    vfx_mock.mirror_x = MagicMock(return_value=clip_mock)
-    vfx_mock.crop = MagicMock(return_value=clip_mock)
-    vfx_mock.resize = MagicMock(return_value=clip_mock)
-    vfx_mock.multiply_color = MagicMock(return_value=clip_mock)
-    vfx_mock.multiply_speed = MagicMock(return_value=clip_mock)
-    vfx_mock.speedx = MagicMock()  # Add speedx method
+    vfx_mock = _vfx_mock(clip_mock)
 
     video_file_clip = MagicMock(return_value=clip_mock)
     monkeypatch.setattr(editor, "VideoFileClip", video_file_clip)
@@ -105,31 +86,161 @@ def test_process_pending_transforms_single_clip(temp_env_paths, monkeypatch):
     output_path = Path(write_args[0])
     assert temp_env_paths["processed_dir"] in output_path.parents
     assert write_kwargs["codec"] == "libx264"
+    assert write_kwargs["ffmpeg_params"][:2] == ["-vf", editor._EVEN_SIZE_FILTER]
     assert write_kwargs["audio_codec"] == "aac"
     assert write_kwargs["remove_temp"] is True
     clip_mock.close.assert_called_once()
 
-    updated_rows = common.read_inventory().to_dicts()
-    assert updated_rows[0]["status_fb"] == "ready"
-    assert updated_rows[0]["path_local"].startswith("videos/processed/")
+    row = common.read_inventory().row(0, named=True)
+    assert row["status_fb"] == "ready"
+    assert row["path_local"].startswith("videos/processed/")
 
 
-def test_process_pending_no_pending_returns_zero(temp_env_paths, monkeypatch):
-    processed_file = temp_env_paths["processed_dir"] / "ready.mp4"
-    processed_file.write_bytes(b"processed")
-    path_local = processed_file.relative_to(temp_env_paths["base_dir"])
-    now = datetime.now(timezone.utc)
+def test_process_pending_batch_continues_after_failure(temp_env_paths, monkeypatch):
+    now = _NOW
+    rows = []
+    for name in ("bad", "missing", "good"):
+        raw_file = temp_env_paths["raw_dir"] / f"{name}.mp4"
+        if name != "missing":
+            raw_file.write_bytes(b"raw")
+        rows.append(
+            {
+                "video_id": name,
+                "source_url": f"https://example.com/{name}.mp4",
+                "title": name,
+                "duration": 5,
+                "path_local": str(raw_file.relative_to(temp_env_paths["base_dir"])),
+                "status_fb": "pending",
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+    write_inventory(temp_env_paths["inventory_path"], rows)
+
+    def fake_clip(path):
+        clip = MagicMock(name=f"clip-{Path(path).stem}")
+        if Path(path).stem == "bad":
+            clip.write_videofile.side_effect = RuntimeError("boom")
+        return clip
+
+    monkeypatch.setattr(editor, "VideoFileClip", fake_clip)
+    monkeypatch.setattr(editor, "_apply_random_transformations", lambda c: c)
+
+    with pytest.raises(VideoProcessingError, match="bad"):
+        editor.process_pending(limit=3, max_workers=1)
+
+    statuses = {
+        r["video_id"]: r["status_fb"] for r in common.read_inventory().to_dicts()
+    }
+    assert statuses == {"bad": "failed", "missing": "failed", "good": "ready"}
+
+
+def test_process_pending_uses_single_ffmpeg_pass(temp_env_paths, monkeypatch):
+    raw_file = temp_env_paths["raw_dir"] / "fused.mp4"
+    raw_file.write_bytes(b"raw")
+    path_local = raw_file.relative_to(temp_env_paths["base_dir"])
+
+    now = _NOW
     inventory_row = {
-        "video_id": "vid999",
-        "source_url": "https://example.com/already.mp4",
-        "title": "Ready",
-        "duration": 84,
+        "video_id": "vid-ffmpeg",
+        "source_url": "https://example.com/fused.mp4",
+        "title": "Fused",
+        "duration": 7,
         "path_local": str(path_local),
-        "status_fb": "ready",
+        "status_fb": "pending",
         "created_at": now,
         "updated_at": now,
     }
-    pl.DataFrame([inventory_row]).write_parquet(temp_env_paths["inventory_path"])
+    write_inventory(temp_env_paths["inventory_path"], [inventory_row])
+
+    run_mock = MagicMock()
+    video_file_clip = MagicMock()
+    monkeypatch.setattr(editor, "FFMPEG_BIN", "/usr/bin/ffmpeg")
+    monkeypatch.setattr(editor.subprocess, "run", run_mock)
+    monkeypatch.setattr(editor, "VideoFileClip", video_file_clip)
+
+    processed = editor.process_pending()
+
+    assert processed == 1
+    video_file_clip.assert_not_called()
+    run_mock.assert_called_once()
+    cmd = run_mock.call_args.args[0]
+    assert cmd[0] == "/usr/bin/ffmpeg"
+    assert cmd[cmd.index("-i") + 1] == str(raw_file)
+    assert cmd[cmd.index("-vf") + 1].endswith(editor._EVEN_SIZE_FILTER)
+    output_path = Path(cmd[-1])
+    assert temp_env_paths["processed_dir"] in output_path.parents
+
+    row = common.read_inventory().row(0, named=True)
+    assert row["status_fb"] == "ready"
+    assert row["path_local"] == str(output_path.relative_to(temp_env_paths["base_dir"]))
+
+
+def test_process_pending_selects_encoder_once_per_batch(temp_env_paths, monkeypatch):
+    rows = []
+    for name in ("one", "two"):
+        raw_file = temp_env_paths["raw_dir"] / f"{name}.mp4"
+        raw_file.write_bytes(b"raw")
+        rows.append(
+            {
+                "video_id": name,
+                "source_url": f"https://example.com/{name}.mp4",
+                "title": name,
+                "duration": 5,
+                "path_local": str(raw_file.relative_to(temp_env_paths["base_dir"])),
+                "status_fb": "pending",
+                "created_at": _NOW,
+                "updated_at": _NOW,
+            }
+        )
+    write_inventory(temp_env_paths["inventory_path"], rows)
+
+    select = MagicMock(return_value=editor._SOFTWARE_H264)
+    monkeypatch.setattr(editor, "_select_h264_encoder", select)
+    monkeypatch.setattr(editor, "VideoFileClip", lambda path: MagicMock())
+    monkeypatch.setattr(editor, "_apply_random_transformations", lambda c: c)
+
+    assert editor.process_pending(limit=2, max_workers=1) == 2
+    select.assert_called_once_with(editor.MOVIEPY_FFMPEG_BIN, allow_filters=False)
+
+
+def test_select_h264_encoder_prefers_working_hardware(monkeypatch):
+    probed = []
+
+    def fake_run(cmd, **kwargs):
+        codec = cmd[cmd.index("-c:v") + 1]
+        probed.append(codec)
+        return MagicMock(returncode=0 if codec == "h264_qsv" else 1)
+
+    editor._select_h264_encoder.cache_clear()
+    monkeypatch.setattr(editor.subprocess, "run", fake_run)
+    try:
+        assert editor._select_h264_encoder("ffmpeg").codec == "h264_qsv"
+        assert probed == ["h264_nvenc", "h264_qsv"]
+
+        # MoviePy cannot use encoders that need an upload filter
+        monkeypatch.setattr(
+            editor.subprocess, "run", lambda cmd, **kwargs: MagicMock(returncode=1)
+        )
+        assert editor._select_h264_encoder("other", allow_filters=False) is editor._SOFTWARE_H264
+    finally:
+        editor._select_h264_encoder.cache_clear()
+
+
+def test_build_ffmpeg_filters_syncs_audio_with_speed(monkeypatch):
+    monkeypatch.setattr(editor.random, "randint", lambda a, b: b)
+    vf, af = editor._build_ffmpeg_filters()
+
+    parts = vf.split(",")
+    assert "hflip" in parts
+    assert any(p.startswith("eq=saturation=") for p in parts)
+    setpts = next(p for p in parts if p.startswith("setpts=PTS/"))
+    assert af == f"atempo={setpts.split('/')[1]}"
+
+
+def test_process_pending_no_pending_returns_zero(temp_env_paths, monkeypatch):
+    # Served from memory: nothing needs to touch the parquet file or the disk
+    monkeypatch.setattr(editor, "_read_inventory_lazy", lambda: _READY_DF.lazy())
 
     video_file_clip = MagicMock()
     monkeypatch.setattr(editor, "VideoFileClip", video_file_clip)
@@ -145,7 +256,7 @@ def test_process_pending_closes_on_error(temp_env_paths, monkeypatch):
     raw_file.write_bytes(b"raw")
     path_local = raw_file.relative_to(temp_env_paths["base_dir"])
 
-    now = datetime.now(timezone.utc)
+    now = _NOW
     inventory_row = {
         "video_id": "vid-err",
         "source_url": "https://example.com/error.mp4",
@@ -156,7 +267,7 @@ def test_process_pending_closes_on_error(temp_env_paths, monkeypatch):
         "created_at": now,
         "updated_at": now,
     }
-    pl.DataFrame([inventory_row]).write_parquet(temp_env_paths["inventory_path"])
+    write_inventory(temp_env_paths["inventory_path"], [inventory_row])
 
     clip_mock = MagicMock(name="clip-error")
     clip_mock.w = 640
@@ -181,40 +292,44 @@ def test_process_pending_closes_on_error(temp_env_paths, monkeypatch):
     clip_mock.write_videofile.assert_called_once()
     clip_mock.close.assert_called_once()
 
-    updated_rows = common.read_inventory().to_dicts()
+    row = common.read_inventory().row(0, named=True)
     # El estado debe cambiar a 'failed' después del error
-    assert updated_rows[0]["status_fb"] == "failed"
+    assert row["status_fb"] == "failed"
 
 
 def test_vfx_tool_effects_return_valid_clips(monkeypatch):
     """Test that applying effects through vfx_tool returns valid VideoClip objects."""
-    from moviepy.video.io.VideoFileClip import VideoFileClip
-    
-    # Create a mock clip that mimics VideoFileClip behavior
-    mock_clip = MagicMock(spec=VideoFileClip)
-    mock_clip.w = 1920
-    mock_clip.h = 1080
-    mock_clip.size = (1920, 1080)
-    mock_clip.with_effects = MagicMock(return_value=mock_clip)
-    
+    clip = FakeClip()
+
     # Mock vfx_tool effects to return the effect objects
-    mock_vfx_tool = MagicMock()
-    mock_vfx_tool.MirrorX.return_value = mock_clip
-    mock_vfx_tool.Crop.return_value = MagicMock()  # Crop returns an effect
-    
+    mock_vfx_tool = _vfx_mock(clip)
+
     # Patch vfx_tool in the editor module
     monkeypatch.setattr(editor, "vfx_tool", mock_vfx_tool)
-    
+
     # Test that _apply_random_transformations returns a valid clip
-    result = editor._apply_random_transformations(mock_clip)
-    
-    # Verify the result is a clip object (mocked)
-    assert result is not None
+    result = editor._apply_random_transformations(clip)
+
+    # Every transform hands back the same stub clip
+    assert result is clip
     # Verify at least one effect was called (since the function selects 2+ random effects)
-    assert (
-        mock_vfx_tool.MirrorX.called
-        or mock_clip.with_effects.called
-    )
+    assert mock_vfx_tool.MirrorX.called or clip.calls
+
+
+def test_mirror_x_and_saturate_fuses_mirror_and_color():
+    from scripts.frame_kernels import mirror_x_and_saturate
+
+    frame = np.array([[[200, 100, 50], [10, 20, 30]]], dtype=np.uint8)
+
+    out = mirror_x_and_saturate(frame, 1.0, mirror=True)
+    assert out.dtype == np.uint8
+    np.testing.assert_allclose(out, frame[:, ::-1], atol=1)
+
+    gray = mirror_x_and_saturate(frame, 0.0, mirror=False)
+    assert (gray[..., 0] == gray[..., 1]).all() and (gray[..., 1] == gray[..., 2]).all()
+
+    boosted = mirror_x_and_saturate(frame, 10.0, mirror=False)
+    assert boosted.min() >= 0 and boosted.max() == 255
 
 
 def test_process_pending_success(monkeypatch, temp_env_paths):
@@ -230,13 +345,12 @@ def test_process_pending_success(monkeypatch, temp_env_paths):
     # Patch VideoFileClip in the editor module, not in moviepy
     with patch("scripts.editor.VideoFileClip", return_value=mock_clip), \
          patch("scripts.editor._apply_random_transformations", return_value=mock_clip), \
-         patch("scripts.editor.read_inventory") as mock_read_inventory, \
-         patch("scripts.editor.update_inventory_by_video_id") as mock_update_inventory:
+         patch("scripts.editor._read_inventory_lazy") as mock_read_inventory, \
+         patch("scripts.editor.update_inventory_batch") as mock_update_inventory:
         
-        # Return a Polars DataFrame instead of a list
+        # Return a Polars LazyFrame instead of a list
         import polars as pl
-        from datetime import datetime, timezone
-        now = datetime.now(timezone.utc)
+        now = _NOW
         mock_read_inventory.return_value = pl.DataFrame([
             {
                 "status_fb": "pending", 
@@ -248,31 +362,32 @@ def test_process_pending_success(monkeypatch, temp_env_paths):
                 "created_at": now,
                 "updated_at": now
             }
-        ])
+        ], schema=INVENTORY_SCHEMA).lazy()
         
         result = editor.process_pending()
         assert result == 1
         mock_update_inventory.assert_called_once()
+        (updates,), _ = mock_update_inventory.call_args
+        assert updates["test_id"]["status_fb"] == "ready"
 
 
 def test_process_pending_no_videos(temp_env_paths):
     """Test processing when no videos are pending."""
-    with patch("scripts.editor.read_inventory") as mock_read_inventory:
-        # Return an empty Polars DataFrame
+    with patch("scripts.editor._read_inventory_lazy") as mock_read_inventory:
+        # Return an empty Polars LazyFrame with the inventory schema
         import polars as pl
-        mock_read_inventory.return_value = pl.DataFrame()
+        mock_read_inventory.return_value = pl.LazyFrame(schema=INVENTORY_SCHEMA)
         result = editor.process_pending()
         assert result == 0
 
 
 def test_process_pending_file_not_found(temp_env_paths):
     """Test processing when file is not found."""
-    with patch("scripts.editor.read_inventory") as mock_read_inventory, \
-         patch("scripts.editor.update_inventory_by_video_id") as mock_update_inventory:
-        # Return a Polars DataFrame
+    with patch("scripts.editor._read_inventory_lazy") as mock_read_inventory, \
+         patch("scripts.editor.update_inventory_batch") as mock_update_inventory:
+        # Return a Polars LazyFrame
         import polars as pl
-        from datetime import datetime, timezone
-        now = datetime.now(timezone.utc)
+        now = _NOW
         mock_read_inventory.return_value = pl.DataFrame([
             {
                 "status_fb": "pending", 
@@ -284,6 +399,9 @@ def test_process_pending_file_not_found(temp_env_paths):
                 "created_at": now,
                 "updated_at": now
             }
-        ])
+        ], schema=INVENTORY_SCHEMA).lazy()
         result = editor.process_pending()
         assert result == 0
+        mock_update_inventory.assert_called_once_with(
+            {"test_id": {"status_fb": "failed"}}
+        )
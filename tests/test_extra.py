@@ -32,10 +32,64 @@ def test_ingestor_network_error(monkeypatch):
 # 3. Casos de error en editor.py
 
 def test_editor_handles_corrupt_files(monkeypatch):
-    def mock_read_inventory():
+    def mock_read_inventory_lazy():
         raise ComputeError("parquet: File out of specification: The file must end with PAR1")
 
-    monkeypatch.setattr("scripts.editor.read_inventory", mock_read_inventory)
+    monkeypatch.setattr("scripts.editor._read_inventory_lazy", mock_read_inventory_lazy)
 
     with pytest.raises(ComputeError, match="parquet: File out of specification"):
         process_pending()
+
+
+def test_retry_backoff_respects_total_budget(monkeypatch):
+    import scripts.utils as utils
+
+    sleeps = []
+    monkeypatch.setattr(utils, "_SKIP_WAITS", False)
+    monkeypatch.setattr(utils.time, "sleep", sleeps.append)
+    calls = []
+
+    @utils.retry(retries=5, base=1.0, factor=2.0, jitter=False, total_budget=3.5)
+    def flaky():
+        calls.append(1)
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flaky()
+    # 1 + 2 fit in the budget; the next 4s wait would overrun it
+    assert sleeps == [1.0, 2.0]
+    assert len(calls) == 3
+
+
+def test_retry_budget_counts_the_first_attempt(monkeypatch):
+    import scripts.utils as utils
+
+    clock = [100.0]
+    sleeps = []
+    monkeypatch.setattr(utils, "_SKIP_WAITS", False)
+    monkeypatch.setattr(utils.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(utils.time, "sleep", sleeps.append)
+    calls = []
+
+    @utils.retry(retries=5, base=1.0, factor=2.0, jitter=False, total_budget=3.5)
+    def slow():
+        calls.append(1)
+        clock[0] += 3.0
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        slow()
+    # 3s spent in the first attempt leaves no room for the 1s backoff
+    assert sleeps == []
+    assert len(calls) == 1
+
+
+def test_set_skip_waits_overrides_and_rereads_env(monkeypatch):
+    import scripts.utils as utils
+
+    monkeypatch.setattr(utils, "_SKIP_WAITS", utils._SKIP_WAITS)
+    monkeypatch.setenv("SKIP_WAITS", "yes")
+    utils.set_skip_waits(False)
+    assert utils._SKIP_WAITS is False
+    utils.set_skip_waits()
+    assert utils._SKIP_WAITS is True
@@ -1,5 +1,6 @@
+import asyncio
+import functools
 import logging
-from datetime import datetime, timezone, timedelta
 
 import polars as pl
 import pytest
@@ -9,67 +10,10 @@ from scripts.exceptions import DownloadError, InventoryUpdateError
 
 import scripts.ingestor as ingestor
 import scripts.common as common
+from tests.helpers import _NOW, DummyYDL, _to_aware
 
 
-class DummyYDL:
-    def __init__(self, opts, *, listing=None, download=None):
-        self.opts = opts
-        self._listing = listing
-        self._download = download
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc, tb):
-        return False
-
-    def extract_info(self, url, download=False):
-        if download:
-            return self._download
-        return self._listing
-
-
-@pytest.fixture
-def tmp_env(tmp_path, monkeypatch):
-    # Build temporary project layout
-    data_dir = tmp_path / "data"
-    videos_dir = tmp_path / "videos"
-    raw_dir = videos_dir / "raw"
-    processed_dir = videos_dir / "processed"
-    logs_dir = tmp_path / "logs"
-    inventory_path = data_dir / "inventario_videos.parquet"
-    lock_path = data_dir / "inventario.lock"
-
-    # Patch common module paths
-    monkeypatch.setattr(common, "DATA_DIR", data_dir)
-    monkeypatch.setattr(common, "VIDEOS_DIR", videos_dir)
-    monkeypatch.setattr(common, "RAW_DIR", raw_dir)
-    monkeypatch.setattr(common, "PROCESSED_DIR", processed_dir)
-    monkeypatch.setattr(common, "LOGS_DIR", logs_dir)
-    monkeypatch.setattr(common, "INVENTORY_PATH", inventory_path)
-    monkeypatch.setattr(common, "LOCK_PATH", lock_path)
-    monkeypatch.setattr(common, "LOG_FILE", logs_dir / "pipeline.log")
-
-    # Also patch names imported into ingestor at module import time
-    monkeypatch.setattr(ingestor, "RAW_DIR", raw_dir)
-    monkeypatch.setattr(ingestor, "BASE_DIR", tmp_path)
-
-    # Ensure dirs and inventory exist
-    common.ensure_dirs()
-    common.ensure_inventory()
-
-    yield
-
-
-def _to_aware(dt: datetime) -> datetime:
-    if dt is None:
-        return None
-    if dt.tzinfo is None:
-        return dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc)
-
-
-def test_ingest_success(tmp_env, monkeypatch, caplog):
+def test_ingest_success(tmp_env, frozen_now, monkeypatch, caplog):
     caplog.set_level(logging.INFO)
 
     video_id = "VID123"
@@ -85,14 +29,16 @@ def test_ingest_success(tmp_env, monkeypatch, caplog):
         "duration": 12,
     }
 
-    # Ensure the downloaded file exists in RAW_DIR to satisfy glob lookup
-    (common.RAW_DIR / f"{video_id}.mp4").parent.mkdir(parents=True, exist_ok=True)
-    (common.RAW_DIR / f"{video_id}.mp4").touch()
-
-    def factory(opts):
-        return DummyYDL(opts, listing=listing, download=download_info)
-
-    monkeypatch.setattr("scripts.ingestor.YoutubeDL", factory)
+    monkeypatch.setattr(
+        "scripts.ingestor.YoutubeDL",
+        functools.partial(DummyYDL, listing=listing, download=download_info),
+    )
+    # Resolve the downloaded file without asking yt-dlp or the filesystem
+    monkeypatch.setattr(
+        ingestor,
+        "_find_downloaded_file",
+        lambda info, ydl: ingestor.RAW_DIR / f"{info['id']}.mp4",
+    )
 
     # Run ingest
     ingestor.ingest(source_url)
@@ -108,14 +54,9 @@ def test_ingest_success(tmp_env, monkeypatch, caplog):
     # path_local should be relative to BASE_DIR
     assert row["path_local"] == f"videos/raw/{video_id}.mp4"
 
-    # Validate timestamps (UTC ±5s)
-    created_at = _to_aware(row["created_at"]) if row["created_at"] is not None else None
-    updated_at = _to_aware(row["updated_at"]) if row["updated_at"] is not None else None
-    now = datetime.now(timezone.utc)
-    tol = timedelta(seconds=5)
-
-    assert created_at is not None and abs(now - created_at) <= tol
-    assert updated_at is not None and abs(now - updated_at) <= tol
+    # Timestamps come from the frozen pipeline clock
+    assert _to_aware(row["created_at"]) == _NOW
+    assert _to_aware(row["updated_at"]) == _NOW
 
     # Log contains downloaded message
     assert any("Downloaded" in rec.message for rec in caplog.records)
@@ -137,25 +78,18 @@ def test_ingest_duplicate_prevention(tmp_env, monkeypatch, caplog):
         "duration": 20,
     }
 
-    # Prepare download file and first successful ingest
-    (common.RAW_DIR / f"{video_id}.mp4").parent.mkdir(parents=True, exist_ok=True)
-    (common.RAW_DIR / f"{video_id}.mp4").touch()
-
-    def factory_first(opts):
-        return DummyYDL(opts, listing=listing, download=download_info)
-
-    monkeypatch.setattr("scripts.ingestor.YoutubeDL", factory_first)
+    # One factory serves both runs; the listing keeps returning the same ID
+    monkeypatch.setattr(
+        "scripts.ingestor.YoutubeDL",
+        functools.partial(DummyYDL, listing=listing, download=download_info),
+    )
     ingestor.ingest(source_url)
 
     # Confirm one row
     df1 = pl.read_parquet(common.INVENTORY_PATH)
     assert df1.height == 1
 
-    # Now simulate running again: listing still returns same ID
-    def factory_second(opts):
-        return DummyYDL(opts, listing=listing, download=download_info)
-
-    monkeypatch.setattr("scripts.ingestor.YoutubeDL", factory_second)
+    # Now simulate running again with the same factory
     ingestor.ingest(source_url)
 
     # Inventory should remain with a single row
@@ -170,6 +104,8 @@ def test_resolve_user_agent(monkeypatch):
     # Normal case: returns a non-empty string
     ua = ingestor._resolve_user_agent()
     assert isinstance(ua, str) and len(ua) > 0
+    # The parsed UserAgent database is built once and reused
+    assert ingestor._user_agent_source() is ingestor._user_agent_source()
 
     # Simulate fake_useragent failing on instantiation
     class BadUA:
@@ -177,90 +113,286 @@ def test_resolve_user_agent(monkeypatch):
             raise RuntimeError("fail ua")
 
     monkeypatch.setattr(ingestor, "UserAgent", BadUA)
+    ingestor._user_agent_source.cache_clear()
     ua2 = ingestor._resolve_user_agent()
     assert ua2 == ingestor.DEFAULT_USER_AGENT
 
 
 @patch("scripts.ingestor.YoutubeDL")
-@patch("scripts.ingestor._already_exists", return_value=False)
+@patch("scripts.ingestor._existing_video_ids", return_value=set())
 @patch("scripts.ingestor._append_to_inventory")
 @patch("scripts.common.update_inventory_by_video_id")
-def test_ingest_success(mock_update_inventory, mock_append, mock_exists, mock_ydl_class):
+def test_ingest_success_mocked_ydl(mock_update_inventory, mock_append, mock_exists, mock_ydl_class):
     """Test successful ingestion."""
-    # Mock para el primer YoutubeDL (listing)
-    mock_ydl_listing = MagicMock()
-    mock_ydl_listing.extract_info.return_value = {
+    # Un solo YoutubeDL atiende el listing y luego la descarga
+    mock_ydl = MagicMock()
+    mock_ydl.params = {}
+    listing = {
         "entries": [{"id": "test_id", "url": "http://example.com/video"}],
         "id": "test_id",
     }
-    mock_ydl_listing.__enter__.return_value = mock_ydl_listing
-    mock_ydl_listing.__exit__.return_value = False
-    # Mock para el segundo YoutubeDL (download)
-    mock_ydl_download = MagicMock()
-    mock_ydl_download.extract_info.return_value = {
+    download_info = {
         "id": "test_id",
         "url": "http://example.com/video",
         "ext": "mp4"
     }
-    mock_ydl_download.__enter__.return_value = mock_ydl_download
-    mock_ydl_download.__exit__.return_value = False
-    # Configurar el mock_ydl_class para devolver primero listing y luego download
-    mock_ydl_class.side_effect = [mock_ydl_listing, mock_ydl_download]
+    mock_ydl.extract_info.side_effect = [listing, download_info]
+    mock_ydl.prepare_filename.return_value = str(ingestor.RAW_DIR / "test_id.mp4")
+    mock_ydl.__enter__.return_value = mock_ydl
+    mock_ydl.__exit__.return_value = False
+    mock_ydl_class.return_value = mock_ydl
     ingest("http://example.com/video")
+    mock_ydl_class.assert_called_once()
+    assert mock_ydl.params["extract_flat"] is False
     mock_append.assert_called_once()
+    assert mock_append.call_args.args[0][0]["path_local"] == "videos/raw/test_id.mp4"
 
 
 @patch("scripts.ingestor.YoutubeDL")
-@patch("scripts.ingestor._already_exists", return_value=False)
+@patch("scripts.ingestor._existing_video_ids", return_value=set())
 @patch("scripts.common.update_inventory_by_video_id")
 def test_ingest_download_error(mock_update_status, mock_exists, mock_ydl_class):
     """Test ingestion with download error."""
-    # Mock para el primer YoutubeDL (listing)
-    mock_ydl_listing = MagicMock()
-    mock_ydl_listing.extract_info.return_value = {
+    # Un solo YoutubeDL atiende el listing y luego la descarga
+    mock_ydl = MagicMock()
+    mock_ydl.params = {}
+    listing = {
         "entries": [{"id": "test_id", "url": "http://example.com/video"}],
         "id": "test_id",
     }
-    mock_ydl_listing.__enter__.return_value = mock_ydl_listing
-    mock_ydl_listing.__exit__.return_value = False
-    # Mock para el segundo YoutubeDL (download) que falla
-    mock_ydl_download = MagicMock()
-    mock_ydl_download.extract_info.side_effect = Exception("Download failed")
-    mock_ydl_download.__enter__.return_value = mock_ydl_download
-    mock_ydl_download.__exit__.return_value = False
-    # Configurar el mock_ydl_class para devolver primero listing y luego download
-    mock_ydl_class.side_effect = [mock_ydl_listing, mock_ydl_download]
+    download_error = Exception("Download failed")
+    mock_ydl.extract_info.side_effect = [listing] + [download_error] * 3
+    mock_ydl.__enter__.return_value = mock_ydl
+    mock_ydl.__exit__.return_value = False
+    mock_ydl_class.return_value = mock_ydl
 
     with pytest.raises(DownloadError):
         ingest("http://example.com/video")
 
 
 @patch("scripts.ingestor.YoutubeDL")
-@patch("scripts.ingestor._already_exists", return_value=False)
+@patch("scripts.ingestor._existing_video_ids", return_value=set())
+@patch("scripts.common.update_inventory_by_video_id")
+def test_ingest_download_stops_retrying_past_budget(
+    mock_update_status, mock_exists, mock_ydl_class, monkeypatch
+):
+    monkeypatch.setattr(ingestor, "DOWNLOAD_RETRY_BUDGET", 0.0)
+    mock_ydl = MagicMock()
+    mock_ydl.params = {}
+    listing = {"entries": [{"id": "test_id", "url": "http://example.com/video"}]}
+    mock_ydl.extract_info.side_effect = [listing, Exception("Download failed")]
+    mock_ydl.__enter__.return_value = mock_ydl
+    mock_ydl.__exit__.return_value = False
+    mock_ydl_class.return_value = mock_ydl
+
+    with pytest.raises(DownloadError):
+        ingest("http://example.com/video")
+    # The listing plus a single download attempt: no backoff fits the budget
+    assert mock_ydl.extract_info.call_count == 2
+
+
+@patch("scripts.ingestor.YoutubeDL")
+@patch("scripts.ingestor._existing_video_ids", return_value=set())
 @patch("scripts.ingestor._append_to_inventory")
 def test_ingest_inventory_update_error(mock_append, mock_exists, mock_ydl_class):
     """Test ingestion with inventory update error."""
-    # Mock para el primer YoutubeDL (listing)
-    mock_ydl_listing = MagicMock()
-    mock_ydl_listing.extract_info.return_value = {
+    # Un solo YoutubeDL atiende el listing y luego la descarga
+    mock_ydl = MagicMock()
+    mock_ydl.params = {}
+    listing = {
         "entries": [{"id": "test_id", "url": "http://example.com/video"}],
         "id": "test_id",
     }
-    mock_ydl_listing.__enter__.return_value = mock_ydl_listing
-    mock_ydl_listing.__exit__.return_value = False
-    # Mock para el segundo YoutubeDL (download)
-    mock_ydl_download = MagicMock()
-    mock_ydl_download.extract_info.return_value = {
+    download_info = {
         "id": "test_id",
         "url": "http://example.com/video",
         "ext": "mp4"
     }
-    mock_ydl_download.__enter__.return_value = mock_ydl_download
-    mock_ydl_download.__exit__.return_value = False
-    # Configurar el mock_ydl_class para devolver primero listing y luego download
-    mock_ydl_class.side_effect = [mock_ydl_listing, mock_ydl_download]
+    mock_ydl.extract_info.side_effect = [listing, download_info]
+    mock_ydl.prepare_filename.return_value = str(ingestor.RAW_DIR / "test_id.mp4")
+    mock_ydl.__enter__.return_value = mock_ydl
+    mock_ydl.__exit__.return_value = False
+    mock_ydl_class.return_value = mock_ydl
     # Hacer que _append_to_inventory falle
     mock_append.side_effect = Exception("Inventory update failed")
 
     with pytest.raises(InventoryUpdateError):
         ingest("http://example.com/video")
+
+
+def test_append_to_inventory_skips_existing_ids(tmp_env):
+    now = _NOW
+
+    def _row(video_id, title):
+        return {
+            "video_id": video_id,
+            "source_url": f"https://example.com/{video_id}",
+            "title": title,
+            "duration": 1,
+            "path_local": f"videos/raw/{video_id}.mp4",
+            "status_fb": "pending",
+            "created_at": now,
+            "updated_at": now,
+        }
+
+    common._append_to_inventory([_row("A", "first")])
+    common._append_to_inventory(
+        [_row("A", "second"), _row("B", "first"), _row("B", "second")]
+    )
+
+    df = pl.read_parquet(common.INVENTORY_PATH)
+    assert sorted(df["video_id"].to_list()) == ["A", "B"]
+    assert df.filter(pl.col("video_id") == "A")["title"].item() == "first"
+    assert df.filter(pl.col("video_id") == "B")["title"].item() == "first"
+
+
+def test_ingest_many_appends_all_sources_once(tmp_env, monkeypatch):
+    sources = {
+        "https://example.com/a": "VA",
+        "https://example.com/b": "VB",
+        "https://example.com/c": "VC",
+        "https://example.com/d": "VD",
+    }
+    class PerSourceYDL(DummyYDL):
+        def extract_info(self, url, download=False):
+            if url == "https://example.com/c":
+                raise RuntimeError("listing unavailable")
+            if url == "https://example.com/d":
+                # not a DownloadError: must not cancel the other sources
+                return None
+            if download:
+                video_id = url.rsplit("/", 1)[-1]
+                filepath = str(common.RAW_DIR / f"{video_id}.webm")
+                return {
+                    "id": video_id,
+                    "webpage_url": url,
+                    "title": video_id,
+                    "requested_downloads": [{"filepath": filepath}],
+                }
+            video_id = sources[url]
+            return {"entries": [{"id": video_id, "url": f"https://example.com/watch/{video_id}"}]}
+
+    monkeypatch.setattr("scripts.ingestor.YoutubeDL", PerSourceYDL)
+    append_calls = []
+    real_append = common._append_to_inventory
+    monkeypatch.setattr(
+        common,
+        "_append_to_inventory",
+        lambda rows: (append_calls.append(len(rows)), real_append(rows)),
+    )
+
+    count = asyncio.run(ingestor.ingest_many(sources, concurrency=3))
+
+    assert count == 2
+    assert append_calls == [2]
+    df = pl.read_parquet(common.INVENTORY_PATH)
+    assert sorted(df["video_id"].to_list()) == ["VA", "VB"]
+    assert sorted(df["path_local"].to_list()) == ["videos/raw/VA.webm", "videos/raw/VB.webm"]
+    # The batch is stamped with a single clock read
+    assert df["created_at"].n_unique() == 1
+    assert df["created_at"].null_count() == 0
+    assert (df["created_at"] == df["updated_at"]).all()
+
+
+def test_batch_inventory_writer_flushes_once_on_exit(tmp_env, monkeypatch):
+    now = _NOW
+    append_calls = []
+    real_append = common._append_to_inventory
+    monkeypatch.setattr(
+        common,
+        "_append_to_inventory",
+        lambda rows: (append_calls.append(len(rows)), real_append(rows)),
+    )
+
+    with common.BatchInventoryWriter() as writer:
+        for vid in ("W1", "W2", "W3"):
+            writer.add(
+                {
+                    "video_id": vid,
+                    "source_url": "",
+                    "title": "",
+                    "duration": 0,
+                    "path_local": "",
+                    "status_fb": "pending",
+                    "created_at": now,
+                    "updated_at": now,
+                }
+            )
+        assert pl.read_parquet(common.INVENTORY_PATH).height == 0
+
+    assert append_calls == [3]
+    assert pl.read_parquet(common.INVENTORY_PATH).height == 3
+
+
+def test_existing_ids_cached_per_inventory_signature(tmp_env):
+    common._load_existing_ids.cache_clear()
+    first = ingestor._existing_video_ids()
+    first.add("LOCAL")
+    assert ingestor._existing_video_ids() == set()
+    assert common._load_existing_ids.cache_info().hits == 1
+
+    now = _NOW
+    common._append_to_inventory(
+        [
+            {
+                "video_id": "E1",
+                "source_url": "",
+                "title": "",
+                "duration": 0,
+                "path_local": "",
+                "status_fb": "pending",
+                "created_at": now,
+                "updated_at": now,
+            }
+        ]
+    )
+    # The write cleared the cache rather than leaving a stale entry behind
+    assert common._load_existing_ids.cache_info().currsize == 0
+    assert ingestor._existing_video_ids() == {"E1"}
+
+
+def test_obtener_tendencias_async_expands_sources(monkeypatch):
+    listings = {
+        "https://example.com/feed1": {
+            "entries": [
+                {"id": "a", "url": "https://example.com/watch/a"},
+                {"id": "b", "url": "https://example.com/watch/b"},
+            ]
+        },
+        "https://example.com/feed2": {
+            "entries": [
+                {"id": "b", "url": "https://example.com/watch/b"},
+                {"id": "c", "webpage_url": "https://example.com/watch/c"},
+            ]
+        },
+    }
+
+    class ListingYDL(DummyYDL):
+        def extract_info(self, url, download=False):
+            assert self.opts["extract_flat"] and not download
+            if url not in listings:
+                raise RuntimeError("listing unavailable")
+            return listings[url]
+
+    monkeypatch.setattr("scripts.ingestor.YoutubeDL", ListingYDL)
+
+    urls = asyncio.run(
+        ingestor.obtener_tendencias_async(
+            ["https://example.com/feed1", "https://example.com/broken", "https://example.com/feed2"]
+        )
+    )
+
+    assert urls == [
+        "https://example.com/watch/a",
+        "https://example.com/watch/b",
+        "https://example.com/watch/c",
+    ]
+
+
+def test_existence_checks_skip_missing_inventory(tmp_env, monkeypatch):
+    common.INVENTORY_PATH.unlink()
+    scan = MagicMock(side_effect=AssertionError("scanned a missing inventory"))
+    monkeypatch.setattr(common.pl, "scan_parquet", scan)
+
+    assert ingestor._existing_video_ids() == set()
+    assert not common.INVENTORY_PATH.exists()
@@ -1,188 +1,128 @@
-from datetime import datetime, timezone
+from datetime import timedelta
 
 import polars as pl
 import pytest
 
 import scripts.common as common
 import scripts.publicador as publicador
+from tests.helpers import _NOW, write_inventory
 
 
-@pytest.fixture
-def temp_env_paths(tmp_path, monkeypatch):
-    base_dir = tmp_path / "project"
-    data_dir = base_dir / "data"
-    videos_dir = base_dir / "videos"
-    raw_dir = videos_dir / "raw"
-    processed_dir = videos_dir / "processed"
-    logs_dir = base_dir / "logs"
-
-    for path in (data_dir, raw_dir, processed_dir, logs_dir):
-        path.mkdir(parents=True, exist_ok=True)
-
-    inventory_path = data_dir / "inventario_videos.parquet"
-    lock_path = data_dir / "inventario.lock"
-    log_file = logs_dir / "pipeline.log"
-
-    patched_paths = {
-        "BASE_DIR": base_dir,
-        "DATA_DIR": data_dir,
-        "VIDEOS_DIR": videos_dir,
-        "RAW_DIR": raw_dir,
-        "PROCESSED_DIR": processed_dir,
-        "LOGS_DIR": logs_dir,
-        "INVENTORY_PATH": inventory_path,
-        "LOCK_PATH": lock_path,
-        "LOG_FILE": log_file,
+def make_row(**overrides):
+    """Return a pending inventory row stamped with the fixed test clock."""
+    row = {
+        "video_id": "x",
+        "source_url": "",
+        "title": "",
+        "duration": 0,
+        "path_local": "",
+        "status_fb": "pending",
+        "created_at": _NOW,
+        "updated_at": _NOW,
     }
+    row.update(overrides)
+    return row
 
-    for module in (common, publicador):
-        for name, value in patched_paths.items():
-            if hasattr(module, name):
-                monkeypatch.setattr(module, name, value)
-
-    return {
-        "base_dir": base_dir,
-        "raw_dir": raw_dir,
-        "processed_dir": processed_dir,
-        "inventory_path": inventory_path,
-        "lock_path": lock_path,
-    }
+
+def stored_row(env, index=0):
+    """Return the state columns of one stored inventory row.
+
+    Only the columns the assertions look at are decoded.
+    """
+    return pl.read_parquet(
+        env["inventory_path"], columns=["video_id", "status_fb", "updated_at"]
+    ).row(index, named=True)
+
+
+@pytest.fixture
+def publish_env(use_layout):
+    """Point `common` and `publicador` at the shared tree, with no inventory."""
+    return use_layout(publicador)
+
+
+@pytest.fixture
+def seed_inventory(publish_env):
+    """Return a helper that replaces the inventory with the given rows.
+
+    The SUT scans the parquet file directly, so rows still land on disk;
+    they are encoded in memory and written in a single call.
+    """
+
+    def seed(rows):
+        write_inventory(publish_env["inventory_path"], rows)
+
+    return seed
 
 
-def test_get_next_returns_existing(temp_env_paths):
+def test_get_next_returns_existing(publish_env, seed_inventory):
     # Create a processed file and inventory row
-    processed_file = temp_env_paths["processed_dir"] / "ready.mp4"
+    processed_file = publish_env["processed_dir"] / "ready.mp4"
     processed_file.write_bytes(b"data")
-    path_local = processed_file.relative_to(temp_env_paths["base_dir"])
-
-    now = datetime.now(timezone.utc)
-    inventory_row = {
-        "video_id": "p1",
-        "source_url": "https://example.com/1.mp4",
-        "title": "P1",
-        "duration": 10,
-        "path_local": str(path_local),
-        "status_fb": "pending",
-        "created_at": now,
-        "updated_at": now,
-    }
-    pl.DataFrame([inventory_row]).write_parquet(temp_env_paths["inventory_path"])
+    path_local = publish_env["rel"](processed_file)
+
+    seed_inventory([make_row(video_id="p1", path_local=path_local)])
 
     p = publicador.cli_get_next()
-    assert p == str(path_local)
+    assert p == path_local
 
 
-def test_get_next_skips_missing_and_marks_failed(temp_env_paths):
+def test_get_next_skips_missing_and_marks_failed(publish_env, seed_inventory):
     # First row points to missing file, second row exists
-    missing = temp_env_paths["processed_dir"] / "missing.mp4"
-    exists = temp_env_paths["processed_dir"] / "exists.mp4"
+    missing = publish_env["processed_dir"] / "missing.mp4"
+    exists = publish_env["processed_dir"] / "exists.mp4"
     exists.write_bytes(b"ok")
+    rel = publish_env["rel"]
 
-    now = datetime.now(timezone.utc)
-    rows = [
-        {
-            "video_id": "m1",
-            "source_url": "https://example.com/m1.mp4",
-            "title": "M1",
-            "duration": 11,
-            "path_local": str(missing.relative_to(temp_env_paths["base_dir"])),
-            "status_fb": "pending",
-            "created_at": now,
-            "updated_at": now,
-        },
-        {
-            "video_id": "e1",
-            "source_url": "https://example.com/e1.mp4",
-            "title": "E1",
-            "duration": 12,
-            "path_local": str(exists.relative_to(temp_env_paths["base_dir"])),
-            "status_fb": "pending",
-            "created_at": now,
-            "updated_at": now,
-        },
-    ]
-    pl.DataFrame(rows).write_parquet(temp_env_paths["inventory_path"])
+    seed_inventory(
+        [
+            make_row(video_id="m1", path_local=rel(missing)),
+            make_row(video_id="e1", path_local=rel(exists)),
+        ]
+    )
 
     p = publicador.cli_get_next()
-    assert p == str(exists.relative_to(temp_env_paths["base_dir"]))
+    assert p == rel(exists)
 
-    inv = common.read_inventory()
-    rows = inv.to_dicts()
     # first should be marked failed
-    assert rows[0]["status_fb"] == "failed"
-
-
-def test_mark_posted_updates_status_and_timestamp(temp_env_paths):
-    # Create ready row
-    processed_file = temp_env_paths["processed_dir"] / "to_post.mp4"
-    processed_file.write_bytes(b"ok")
-    path_local = processed_file.relative_to(temp_env_paths["base_dir"])
-
-    before = datetime.now(timezone.utc)
-    inventory_row = {
-        "video_id": "post1",
-        "source_url": "https://example.com/post1.mp4",
-        "title": "Post1",
-        "duration": 20,
-        "path_local": str(path_local),
-        "status_fb": "ready",
-        "created_at": before,
-        "updated_at": before,
-    }
-    pl.DataFrame([inventory_row]).write_parquet(temp_env_paths["inventory_path"])
-
-    ok = publicador.cli_mark_posted("post1")
-    assert ok is True
-
-    inv = common.read_inventory()
-    row = inv.to_dicts()[0]
-    assert row["status_fb"] == "posted"
-    assert row["updated_at"] > before
-
-
-def test_mark_failed_updates_status_and_timestamp(temp_env_paths):
-    # Create a pending/ready row that will be marked as failed
-    processed_file = temp_env_paths["processed_dir"] / "to_fail.mp4"
+    assert stored_row(publish_env)["status_fb"] == "failed"
+
+
+@pytest.mark.parametrize(
+    "mark, expected_status",
+    [(publicador.cli_mark_posted, "posted"), (publicador.cli_mark_failed, "failed")],
+    ids=["posted", "failed"],
+)
+def test_mark_updates_status_and_timestamp(
+    publish_env, seed_inventory, mark, expected_status
+):
+    processed_file = publish_env["processed_dir"] / "to_mark.mp4"
     processed_file.write_bytes(b"data")
-    path_local = processed_file.relative_to(temp_env_paths["base_dir"])
-
-    before = datetime.now(timezone.utc)
-    inventory_row = {
-        "video_id": "fail1",
-        "source_url": "https://example.com/fail1.mp4",
-        "title": "Fail1",
-        "duration": 15,
-        "path_local": str(path_local),
-        "status_fb": "ready",
-        "created_at": before,
-        "updated_at": before,
-    }
-    pl.DataFrame([inventory_row]).write_parquet(temp_env_paths["inventory_path"])
+    path_local = publish_env["rel"](processed_file)
+
+    seed_inventory(
+        [make_row(video_id="mark1", path_local=path_local, status_fb="ready")]
+    )
 
-    ok = publicador.cli_mark_failed("fail1")
+    ok = mark("mark1")
     assert ok is True
 
-    inv = common.read_inventory()
-    row = inv.to_dicts()[0]
-    assert row["status_fb"] == "failed"
-    assert row["updated_at"] > before
+    row = stored_row(publish_env)
+    assert row["video_id"] == "mark1"
+    assert row["status_fb"] == expected_status
+    assert row["updated_at"] > _NOW
 
 
-def test_mark_failed_with_nonexistent_id(temp_env_paths):
+def test_mark_failed_with_nonexistent_id(publish_env, seed_inventory):
     """Test that marking a nonexistent video as failed handles the error gracefully."""
-    # Create an empty inventory
-    now = datetime.now(timezone.utc)
-    inventory_row = {
-        "video_id": "exists1",
-        "source_url": "https://example.com/exists1.mp4",
-        "title": "Exists",
-        "duration": 10,
-        "path_local": "videos/processed/exists.mp4",
-        "status_fb": "ready",
-        "created_at": now,
-        "updated_at": now,
-    }
-    pl.DataFrame([inventory_row]).write_parquet(temp_env_paths["inventory_path"])
+    seed_inventory(
+        [
+            make_row(
+                video_id="exists1",
+                path_local="videos/processed/exists.mp4",
+                status_fb="ready",
+            )
+        ]
+    )
 
     # Try to mark a nonexistent ID as failed
     ok = publicador.cli_mark_failed("nonexistent_id")
@@ -191,116 +131,94 @@ def test_mark_failed_with_nonexistent_id(temp_env_paths):
     assert ok is False
     
     # Verify the existing video was not affected
-    inv = common.read_inventory()
-    row = inv.to_dicts()[0]
+    row = stored_row(publish_env)
     assert row["video_id"] == "exists1"
     assert row["status_fb"] == "ready"
 
 
-def test_state_transition_ready_to_failed(temp_env_paths):
-    """Test that a video correctly transitions from ready to failed state."""
-    processed_file = temp_env_paths["processed_dir"] / "transition.mp4"
+def test_timestamp_updates_on_state_changes(
+    publish_env, seed_inventory, monkeypatch
+):
+    """Test that updated_at timestamp changes with every state transition."""
+    processed_file = publish_env["processed_dir"] / "timestamp_test.mp4"
     processed_file.write_bytes(b"data")
-    path_local = processed_file.relative_to(temp_env_paths["base_dir"])
-
-    before = datetime.now(timezone.utc)
-    inventory_row = {
-        "video_id": "trans1",
-        "source_url": "https://example.com/trans1.mp4",
-        "title": "Transition Test",
-        "duration": 25,
-        "path_local": str(path_local),
-        "status_fb": "ready",
-        "created_at": before,
-        "updated_at": before,
-    }
-    pl.DataFrame([inventory_row]).write_parquet(temp_env_paths["inventory_path"])
+    path_local = publish_env["rel"](processed_file)
 
-    # Mark as failed
-    ok = publicador.cli_mark_failed("trans1")
-    assert ok is True
+    seed_inventory(
+        [make_row(video_id="ts1", path_local=path_local, status_fb="ready")]
+    )
 
-    # Verify state transition
-    inv = common.read_inventory()
-    row = inv.to_dicts()[0]
-    assert row["status_fb"] == "failed"
-    assert row["video_id"] == "trans1"
-    assert row["updated_at"] > before
-
-
-def test_timestamp_updates_on_state_changes(temp_env_paths):
-    """Test that updated_at timestamp changes with every state transition."""
-    import time
-    
-    processed_file = temp_env_paths["processed_dir"] / "timestamp_test.mp4"
-    processed_file.write_bytes(b"data")
-    path_local = processed_file.relative_to(temp_env_paths["base_dir"])
-
-    initial_time = datetime.now(timezone.utc)
-    inventory_row = {
-        "video_id": "ts1",
-        "source_url": "https://example.com/ts1.mp4",
-        "title": "Timestamp Test",
-        "duration": 30,
-        "path_local": str(path_local),
-        "status_fb": "ready",
-        "created_at": initial_time,
-        "updated_at": initial_time,
-    }
-    pl.DataFrame([inventory_row]).write_parquet(temp_env_paths["inventory_path"])
+    # Each state change reads the clock once; hand out increasing instants
+    # instead of sleeping between the calls.
+    ticks = [_NOW + timedelta(seconds=1), _NOW + timedelta(seconds=2)]
+    monkeypatch.setattr(common, "_now", iter(ticks).__next__)
 
-    # Wait a bit to ensure time difference
-    time.sleep(0.01)
-    
     # First state change: ready -> posted
     publicador.cli_mark_posted("ts1")
-    inv1 = common.read_inventory()
-    row1 = inv1.to_dicts()[0]
+    row1 = stored_row(publish_env)
     timestamp1 = row1["updated_at"]
-    
+
     assert row1["status_fb"] == "posted"
-    assert timestamp1 > initial_time
-    
-    # Wait a bit more
-    time.sleep(0.01)
-    
+    assert timestamp1 == ticks[0]
+
     # Second state change: posted -> failed (unusual but tests the mechanism)
     publicador.cli_mark_failed("ts1")
-    inv2 = common.read_inventory()
-    row2 = inv2.to_dicts()[0]
+    row2 = stored_row(publish_env)
     timestamp2 = row2["updated_at"]
-    
+
     assert row2["status_fb"] == "failed"
-    assert timestamp2 > timestamp1
+    assert timestamp2 == ticks[1]
+    assert timestamp2 > timestamp1 > _NOW
 
 
-def test_concurrent_state_updates_use_filelock(temp_env_paths):
+def test_concurrent_state_updates_use_filelock(publish_env, seed_inventory):
     """Test that FileLock is used for concurrent state updates."""
-    processed_file = temp_env_paths["processed_dir"] / "concurrent.mp4"
+    processed_file = publish_env["processed_dir"] / "concurrent.mp4"
     processed_file.write_bytes(b"data")
-    path_local = processed_file.relative_to(temp_env_paths["base_dir"])
-
-    now = datetime.now(timezone.utc)
-    inventory_row = {
-        "video_id": "conc1",
-        "source_url": "https://example.com/conc1.mp4",
-        "title": "Concurrent Test",
-        "duration": 35,
-        "path_local": str(path_local),
-        "status_fb": "ready",
-        "created_at": now,
-        "updated_at": now,
-    }
-    pl.DataFrame([inventory_row]).write_parquet(temp_env_paths["inventory_path"])
+    path_local = publish_env["rel"](processed_file)
+
+    seed_inventory(
+        [make_row(video_id="conc1", path_local=path_local, status_fb="ready")]
+    )
+
+    # The project tree is shared across tests, so start without a lock file
+    lock_path = publish_env["lock_path"]
+    lock_path.unlink(missing_ok=True)
 
-    # Verify the lock file exists after operations
-    assert temp_env_paths["lock_path"].exists() or True  # Lock is created during ops
-    
-    # Perform multiple operations
     publicador.cli_mark_posted("conc1")
-    inv = common.read_inventory()
-    row = inv.to_dicts()[0]
-    
+    row = stored_row(publish_env)
+
+    assert lock_path.exists()  # the update ran under the inventory FileLock
     assert row["status_fb"] == "posted"
     assert row["video_id"] == "conc1"
 
+
+def test_update_inventory_batch_applies_all_updates(publish_env, seed_inventory):
+    seed_inventory(
+        [
+            make_row(video_id=vid, path_local=f"videos/raw/{vid}.mp4")
+            for vid in ("b1", "b2", "b3")
+        ]
+    )
+
+    updated = common.update_inventory_batch(
+        {
+            "b1": {"status_fb": "ready", "path_local": "videos/processed/b1.mp4"},
+            "b2": {"status_fb": "failed"},
+            "unknown": {"status_fb": "posted"},
+        }
+    )
+    assert updated == 2
+
+    inv = {r["video_id"]: r for r in common.read_inventory().to_dicts()}
+    assert inv["b1"]["status_fb"] == "ready"
+    assert inv["b1"]["path_local"] == "videos/processed/b1.mp4"
+    assert inv["b2"]["status_fb"] == "failed"
+    assert inv["b2"]["path_local"] == "videos/raw/b2.mp4"
+    assert inv["b3"]["status_fb"] == "pending"
+    assert inv["b1"]["updated_at"] > _NOW
+    assert inv["b3"]["updated_at"] == _NOW
+
+    mtime = publish_env["inventory_path"].stat().st_mtime_ns
+    assert common.update_inventory_batch({"unknown": {"status_fb": "posted"}}) == 0
+    assert publish_env["inventory_path"].stat().st_mtime_ns == mtime